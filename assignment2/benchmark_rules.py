@@ -0,0 +1,62 @@
+"""
+pytest-benchmark suite for the rules engine and the heuristic. It is not collected by a plain
+pytest run; run it on its own, store a baseline, and compare later runs against it to flag
+slowdowns:
+
+    python -m pytest benchmark_rules.py --benchmark-save=baseline
+    python -m pytest benchmark_rules.py --benchmark-compare=0001 --benchmark-compare-fail=mean:25%
+
+After an intended speed change, store a new baseline. Baselines live in .benchmarks/, grouped by
+machine, and are not committed, since timings only compare on the machine that took them.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from game import BoardState, Rules
+from perft import PERFT_POSITIONS
+from search import calc_h
+
+
+def make_boards():
+    boards = []
+    for _, (encoded_state, player_idx), _ in PERFT_POSITIONS:
+        board = BoardState()
+        for idx, pos in enumerate(encoded_state):
+            board.update(idx, pos)
+        boards.append((board, player_idx))
+    return boards
+
+
+BOARDS = make_boards()
+
+
+def all_piece_actions():
+    for board, player_idx in BOARDS:
+        offset_idx = player_idx * 6
+        for idx in range(offset_idx, offset_idx + 5):
+            if board.state[idx] != board.state[offset_idx + 5]:
+                Rules.single_piece_actions(board, idx)
+
+
+def all_ball_actions():
+    for board, _ in BOARDS:
+        Rules.single_ball_actions(board, 0)
+        Rules.single_ball_actions(board, 1)
+
+
+def all_calc_h():
+    for board, player_idx in BOARDS:
+        calc_h(board, player_idx, True)
+        calc_h(board, player_idx, False)
+
+
+def all_is_valid():
+    for board, _ in BOARDS:
+        board.is_valid()
+
+
+@pytest.mark.parametrize("fnc", [all_piece_actions, all_ball_actions, all_calc_h, all_is_valid],
+                         ids=["single_piece_actions", "single_ball_actions", "calc_h", "is_valid"])
+def test_rules_benchmark(benchmark, fnc):
+    benchmark(fnc)
@@ -1,5 +1,166 @@
+import asyncio
+import inspect
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 import numpy as np
 
+N_ROWS = 8
+N_COLS = 7
+N_SQUARES = N_ROWS * N_COLS
+
+# Knight-style offsets (col, row) used by block pieces
+KNIGHT_OFFSETS = ((1, 2), (-1, 2), (-2, 1), (2, 1), (2, -1), (-2, -1), (-1, -2), (1, -2))
+# Queen-style directions (col, row) used by ball passes
+RAY_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (-1, -1), (-1, 1), (1, -1))
+
+
+def _build_knight_attacks():
+    attacks = []
+    for sq in range(N_SQUARES):
+        col_0, row_0 = sq % N_COLS, sq // N_COLS
+        mask = 0
+        for col_move, row_move in KNIGHT_OFFSETS:
+            col, row = col_0 + col_move, row_0 + row_move
+            if 0 <= col < N_COLS and 0 <= row < N_ROWS:
+                mask |= 1 << (row * N_COLS + col)
+        attacks.append(mask)
+    return tuple(attacks)
+
+
+def _build_rays():
+    rays = []
+    for sq in range(N_SQUARES):
+        col_0, row_0 = sq % N_COLS, sq // N_COLS
+        sq_rays = []
+        for col_move, row_move in RAY_DIRECTIONS:
+            col, row = col_0 + col_move, row_0 + row_move
+            ray = []
+            while 0 <= col < N_COLS and 0 <= row < N_ROWS:
+                ray.append(row * N_COLS + col)
+                col, row = col + col_move, row + row_move
+            if ray:
+                sq_rays.append((tuple(ray), sum(1 << t for t in ray)))
+        rays.append(tuple(sq_rays))
+    return tuple(rays)
+
+
+def _build_lines_and_between():
+    lines = [0] * N_SQUARES
+    between = [0] * (N_SQUARES * N_SQUARES)
+    for sq in range(N_SQUARES):
+        for ray, ray_mask in RAYS[sq]:
+            lines[sq] |= ray_mask
+            channel = 0
+            for t in ray:
+                between[sq * N_SQUARES + t] = channel
+                channel |= 1 << t
+    return tuple(lines), tuple(between)
+
+
+def _build_knight_distance():
+    distance = [-1] * (N_SQUARES * N_SQUARES)
+    for sq in range(N_SQUARES):
+        row = distance[sq * N_SQUARES:(sq + 1) * N_SQUARES]
+        row[sq] = 0
+        frontier = [sq]
+        while frontier:
+            next_frontier = []
+            for a in frontier:
+                for b in range(N_SQUARES):
+                    if KNIGHT_ATTACKS[a] >> b & 1 and row[b] < 0:
+                        row[b] = row[a] + 1
+                        next_frontier.append(b)
+            frontier = next_frontier
+        distance[sq * N_SQUARES:(sq + 1) * N_SQUARES] = row
+    return tuple(distance)
+
+
+SQUARE_BITS = tuple(1 << sq for sq in range(N_SQUARES))
+# DECODED_SQUARES[sq] is the (col, row) of encoded position sq
+DECODED_SQUARES = tuple((sq % N_COLS, sq // N_COLS) for sq in range(N_SQUARES))
+KNIGHT_ATTACKS = _build_knight_attacks()
+# RAYS[sq] holds, for every direction leaving sq, the squares along it (nearest first) and their mask
+RAYS = _build_rays()
+# Layout of a PackedState key: twelve 6-bit positions (slot i at bit 6 * i) followed by the side to move
+SLOT_BITS = 6
+SLOT_MASK = (1 << SLOT_BITS) - 1
+PLAYER_SHIFT = 12 * SLOT_BITS
+
+# Zobrist keys are generated from a fixed seed so hashes are stable across runs and processes
+ZOBRIST_SEED = 20231105
+
+
+def _build_zobrist():
+    rng = random.Random(ZOBRIST_SEED)
+    keys = tuple(tuple(rng.getrandbits(64) for _ in range(SLOT_MASK + 1)) for _ in range(12))
+    return keys, rng.getrandbits(64)
+
+
+# QUEEN_LINES[sq] is the mask of squares sharing a row, column or diagonal with sq, and
+# BETWEEN[a * N_SQUARES + b] is the mask of squares strictly between two such squares a and b
+QUEEN_LINES, BETWEEN = _build_lines_and_between()
+# KNIGHT_DISTANCE[a * N_SQUARES + b] is the fewest knight moves from a to b on an empty board
+KNIGHT_DISTANCE = _build_knight_distance()
+# ZOBRIST_KEYS[idx][pos] is xor-ed into the hash for every slot idx at encoded position pos, and
+# ZOBRIST_SIDE is xor-ed in when black is to move
+ZOBRIST_KEYS, ZOBRIST_SIDE = _build_zobrist()
+
+# Counter of move generation calls by function name for the current context, set by count_movegen.
+# Each thread and asyncio task has its own context, so searches running side by side never count
+# into each other's counter. When it is None, the counted functions pay for a lookup and a None check.
+MOVEGEN_COUNTS = ContextVar("movegen_counts", default=None)
+
+
+@contextmanager
+def count_movegen(counts):
+    """
+    Counts move generation calls made in this context into counts, a Counter, inside the with
+    block (None counts nothing). The previous counter is restored on the way out, even if the
+    block raises.
+    """
+    token = MOVEGEN_COUNTS.set(counts)
+    try:
+        yield counts
+    finally:
+        MOVEGEN_COUNTS.reset(token)
+
+
+def zobrist_hash(state, player_idx):
+    """
+    Returns the 64 bit Zobrist hash of an encoded state and the player to move. Moving slot idx
+    from old to new changes the hash by ZOBRIST_KEYS[idx][old] ^ ZOBRIST_KEYS[idx][new] ^ ZOBRIST_SIDE.
+    """
+    key = ZOBRIST_SIDE if player_idx == 1 else 0
+    for idx, pos in enumerate(state):
+        key ^= ZOBRIST_KEYS[idx][pos]
+    return key
+
+
+def legal_actions(state, player_idx):
+    """
+    Returns the set of (relative_idx, encoded position) actions player_idx can take in state, an
+    encoded state of 12 integers. Only reads its arguments and the constant tables above, apart
+    from counting the call into the current context's counter (see count_movegen), so any number
+    of threads or tasks can call it at once.
+    """
+    counts = MOVEGEN_COUNTS.get()
+    if counts is not None:
+        counts["legal_actions"] += 1
+    return BitboardRules.generate_valid_actions(state, player_idx)
+
+
+def iter_bits(mask):
+    """
+    Yields the square index of every set bit in mask, lowest first
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
 
 class Player:
     def __init__(self, policy_fnc):
@@ -8,17 +169,38 @@ class Player:
     def policy(self, decode_state):
         pass
 
+    def close(self):
+        """
+        Releases whatever the player holds on to between moves (worker processes, threads)
+        """
+        pass
+
 
 class AdversarialSearchPlayer(Player):
-    def __init__(self, gsp, player_idx):
+    def __init__(self, gsp, player_idx, plies=3, time_budget=None, ponder=False):
         # You can customize the signature of the constructor above to suit your needs.
         # In this example, in the above parameters, gsp is a GameStateProblem, and
         # gsp.adversarial_search_method is a method of that class.
-
+        #
+        # plies is the search depth. With a time_budget (seconds per move), the search deepens
+        # until the budget runs out instead, and plies caps the depth (None for no cap).
+        #
+        # With ponder, the player keeps searching the likely replies in a background thread while
+        # the opponent thinks (see GameStateProblem.ponder), and its next search reuses that work
+        # through the transposition table. The background search shares the interpreter lock with
+        # the opponent, so it only comes for free against an opponent in another process. Call
+        # close once the game is over. Pondering needs a gsp without workers, whose searches use
+        # its own transposition table.
+
+        if ponder and gsp.workers:
+            raise ValueError("Pondering needs a GameStateProblem without workers")
         super().__init__(gsp.adversarial_search_method)
         self.gsp = gsp
         self.b = BoardState()
         self.player_idx = player_idx
+        self.plies = plies
+        self.time_budget = time_budget
+        self.ponder = ponder
 
     def policy(self, decode_state):
         # Here, the policy of the player is to consider the current decoded game state
@@ -26,10 +208,40 @@ class AdversarialSearchPlayer(Player):
         # assigned policy_fnc (which in this case is gsp.adversarial_search_method), and then
         # return the result of self.policy_fnc
 
+        self.stop_pondering()
         encoded_state_tup = tuple(self.b.encode_single_pos(s) for s in decode_state)
         state_tup = tuple((encoded_state_tup, self.player_idx))
-        val_a, val_b, val_c = (1, 2, 3)
-        return self.policy_fnc(state_tup, None, self.player_idx, val_c)
+        action, value = self.policy_fnc(state_tup, None, self.player_idx, self.plies, self.time_budget)
+        if self.ponder and action is not None:
+            # Without a depth cap, pondering goes one ply past the depth the last search reached
+            plies = self.plies if self.plies is not None else self.gsp.completed_depth + 1
+            self.gsp.start_pondering(self.gsp.execute(state_tup, action), plies)
+        return action, value
+
+    def stop_pondering(self):
+        self.gsp.stop_pondering()
+
+    def close(self):
+        """
+        Stops pondering and shuts down the search's worker processes, if any were started
+        """
+        self.stop_pondering()
+        self.gsp.close()
+
+
+class RandomPlayer(Player):
+    def __init__(self, player_idx, seed=None):
+        # Plays a uniformly random valid action; seed makes the sequence of choices reproducible.
+        super().__init__(None)
+        self.b = BoardState()
+        self.player_idx = player_idx
+        self.rng = random.Random(seed)
+
+    def policy(self, decode_state):
+        encoded_state = [self.b.encode_single_pos(s) for s in decode_state]
+        # Sorted so the choice only depends on the seed, not on set iteration order
+        actions = sorted(legal_actions(encoded_state, self.player_idx))
+        return self.rng.choice(actions), None
 
 
 class BoardState:
@@ -145,6 +357,122 @@ class BoardState:
         return True
 
 
+class PackedState:
+    """
+    An immutable, hashable game state. The 12 encoded positions and the player to move are packed
+    into a single integer, and the tuple / decoded forms are only built when first asked for.
+
+    It exposes the same state and decode_state attributes as BoardState, so it can be handed
+    straight to the move generator and the heuristic.
+    """
+    __slots__ = ("_key", "_state", "_decode_state")
+
+    def __init__(self, key: int):
+        self._key = key
+        self._state = None
+        self._decode_state = None
+
+    @classmethod
+    def from_state(cls, state, player_idx: int):
+        """
+        Packs an encoded state (12 integers) and the player to move
+        """
+        key = player_idx << PLAYER_SHIFT
+        for i, pos in enumerate(state):
+            if not 0 <= pos <= SLOT_MASK:
+                raise ValueError(f"Position {pos} at index {i} cannot be packed into {SLOT_BITS} bits")
+            key |= int(pos) << (SLOT_BITS * i)
+        return cls(key)
+
+    @classmethod
+    def from_tuple(cls, state_tup: tuple):
+        """
+        Packs a search state of the form ((12 encoded positions), player_idx)
+        """
+        return cls.from_state(state_tup[0], state_tup[1])
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def player_idx(self):
+        return self._key >> PLAYER_SHIFT
+
+    @property
+    def state(self):
+        if self._state is None:
+            key = self._key
+            self._state = tuple((key >> (SLOT_BITS * i)) & SLOT_MASK for i in range(12))
+        return self._state
+
+    @property
+    def decode_state(self):
+        if self._decode_state is None:
+            self._decode_state = [(pos % N_COLS, pos // N_COLS) for pos in self.state]
+        return self._decode_state
+
+    def position(self, idx: int):
+        """
+        Returns the encoded position at index idx without unpacking the rest of the state
+        """
+        return (self._key >> (SLOT_BITS * idx)) & SLOT_MASK
+
+    def to_tuple(self):
+        """
+        Returns the state in the ((12 encoded positions), player_idx) form used by GameStateProblem
+        """
+        return self.state, self.player_idx
+
+    def execute(self, action: tuple):
+        """
+        Returns the state reached when the player to move takes action, (relative_idx, position)
+        """
+        rel_idx, pos = action
+        player_idx = self._key >> PLAYER_SHIFT
+        shift = SLOT_BITS * (player_idx * 6 + rel_idx)
+        key = (self._key & ~(SLOT_MASK << shift)) | (int(pos) << shift)
+        return PackedState(key ^ (1 << PLAYER_SHIFT))
+
+    def is_valid(self):
+        """
+        Same check as BoardState.is_valid, done on masks
+        """
+        state = self.state
+        white = 0
+        black = 0
+        for pos in state[:5]:
+            if pos >= N_SQUARES:
+                return False
+            white |= SQUARE_BITS[pos]
+        for pos in state[6:11]:
+            if pos >= N_SQUARES:
+                return False
+            black |= SQUARE_BITS[pos]
+        if state[5] >= N_SQUARES or state[11] >= N_SQUARES:
+            return False
+        # Ten distinct blocks, and each ball sits on one of its own blocks
+        return bin(white | black).count("1") == 10 and \
+            white & SQUARE_BITS[state[5]] and black & SQUARE_BITS[state[11]]
+
+    def is_termination_state(self):
+        """
+        Same check as BoardState.is_termination_state
+        """
+        if not self.is_valid():
+            return False
+        return 49 <= self.position(5) <= 55 or self.position(11) <= 6
+
+    def __eq__(self, other):
+        return isinstance(other, PackedState) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return f"PackedState({self.state}, {self.player_idx})"
+
+
 class Rules:
 
     @staticmethod
@@ -166,26 +494,11 @@ class Rules:
         if piece_idx == board_state.white_ball_index or piece_idx == board_state.black_ball_index:
             raise ValueError("A block can only be moved if it is not holding a ball!")
 
-        col_0, row_0 = board_state.decode_state[piece_idx]  # Gets the col,row of the piece we care about
-
-        # Occupied spaces are all the other pieces (except for the piece we are looking at)
-        occupied_spaces = [(col, row) for i, (col, row) in enumerate(board_state.decode_state) if i != piece_idx]
-
-        # Moves are similar to a knight, so we create all 8 here
-        possible_move_values = [(1, 2), (-1, 2), (-2, 1), (2, 1), (2, -1), (-2, -1), (-1, -2), (1, -2)]
-
-        legal_moves = set()
-
+        counts = MOVEGEN_COUNTS.get()
+        if counts is not None:
+            counts["single_piece_actions"] += 1
         # Rules 2: A block can only move to unoccupied spaces on the board
-        for col_move, row_move in possible_move_values:
-            col = col_0 + col_move
-            row = row_0 + row_move
-            if 0 <= col < board_state.N_COLS and 0 <= row < board_state.N_ROWS \
-                    and (col, row) not in occupied_spaces:
-                legal_moves.add((col, row))
-
-        # We need to encode the legal moves back to integers and return
-        return [board_state.encode_single_pos((col, row)) for col, row in legal_moves]
+        return BitboardRules.single_piece_actions(board_state.state, piece_idx)
 
     @staticmethod
     def find_ball_coords(board_state, player_idx):
@@ -218,29 +531,6 @@ class Rules:
 
         return list(l)
 
-    @staticmethod
-    def diagonal_move_available(ball_col, ball_row, catch_col, catch_row, opposing_pieces):
-
-        if abs(catch_col - ball_col) == abs(catch_row - ball_row):  # If the difference its equal, its diag
-
-            distance = abs(catch_col - ball_col)
-            # Iterate ovefr all possible diagonals to check if opposing pieces exist there
-            for i in range(1, distance):
-                if catch_col < ball_col and catch_row < ball_row:  # Lower left
-                    target = ball_col - i, ball_row - i
-                elif catch_col > ball_col and catch_row > ball_row:  # Upper right
-                    target = ball_col + i, ball_row + i
-                elif catch_col < ball_col and catch_row > ball_row:  # Upper left
-                    target = ball_col - i, ball_row + i
-                else:
-                    target = ball_col + i, ball_row - i
-
-                if target in opposing_pieces:
-                    return False
-            return True
-        else:
-            return False
-
     @staticmethod
     def single_ball_actions(board_state, player_idx):
         """
@@ -263,52 +553,321 @@ class Rules:
         Therefore, in a single turn, a player may pass their ball between pieces of the same color an unlimited
         number of times as long as the passing channels for the ball are unobstructed on each pass.
 
-        ball_col + n, ball_row + n == catch_col, catch_row
+        Passes form a graph between the team's blocks, with an edge wherever two blocks share a
+        channel that no opposing block sits in, so the reachable set is a single search over it.
         """
+        counts = MOVEGEN_COUNTS.get()
+        if counts is not None:
+            counts["single_ball_actions"] += 1
+        return BitboardRules.single_ball_actions(board_state.state, player_idx)
 
-        ball_col, ball_row = Rules.find_ball_coords(board_state, player_idx)
-        team_pieces = Rules.find_team_pieces(board_state, player_idx)
-        opposing_pieces = Rules.find_opposing_team_pieces(board_state, player_idx)
 
-        finding_new_moves = True
+class BitboardRules:
+    """
+    Move generation over bitmasks. The 7x8 board has 56 squares, so the occupancy of the board,
+    and of each player's blocks, fits into a single integer where bit n is set if encoded
+    position n is occupied.
 
-        # First, lets find all the possible moves from the current ball location
-        legal_moves = Rules.enumerate_options(ball_col, ball_row, opposing_pieces, team_pieces)
+    All methods take the encoded state (12 integers, as in BoardState.state) and produce the same
+    actions as Rules.
+    """
 
-        # Next, while we continue to find new places for the ball, continue iterating until we
-        # end up with the same set as last time
-        while True:
-            new_moves = set()
-            for col, row in legal_moves:
-                new_moves = new_moves.union(Rules.enumerate_options(col, row, opposing_pieces, team_pieces))
+    @staticmethod
+    def occupancy(state, exclude_idx=None):
+        """
+        Returns the mask of squares covered by any entry of state, optionally skipping exclude_idx
+        """
+        mask = 0
+        for i, pos in enumerate(state):
+            if i != exclude_idx and 0 <= pos < N_SQUARES:
+                mask |= SQUARE_BITS[pos]
+        return mask
 
-            # Combine the new moves with the old
-            new_legal_moves = new_moves.union(legal_moves)
+    @staticmethod
+    def player_masks(state, player_idx):
+        """
+        Returns (team_mask, opposing_mask) for player_idx. The team mask holds the blocks that
+        can catch a pass, which excludes the block currently holding the ball.
+        """
+        white = BitboardRules.occupancy(state[:5])
+        black = BitboardRules.occupancy(state[6:11])
+        if player_idx == 0:
+            return white & ~SQUARE_BITS[state[5]], black
+        else:
+            return black & ~SQUARE_BITS[state[11]], white
 
-            if len(new_legal_moves) == len(legal_moves):
-                break
-            else:
-                legal_moves = new_legal_moves
+    @staticmethod
+    def single_piece_mask(state, piece_idx):
+        """
+        Returns the mask of squares the block at piece_idx can move to
+        """
+        return KNIGHT_ATTACKS[state[piece_idx]] & ~BitboardRules.occupancy(state, piece_idx)
+
+    @staticmethod
+    def single_piece_actions(state, piece_idx):
+        """
+        Returns the list of encoded positions the block at piece_idx can move to
+        """
+        return list(iter_bits(BitboardRules.single_piece_mask(state, piece_idx)))
 
-        return set(board_state.encode_single_pos((col, row)) for col, row in legal_moves)
+    @staticmethod
+    def pass_closure(ball, team_mask, opposing_mask):
+        """
+        Returns the mask of team squares reachable from ball through any number of passes. Each
+        pass is one lookup in BETWEEN, checked against the opposing blocks that could intercept it.
+        """
+        reached = 0
+        frontier = [ball]
+        while frontier:
+            sq = frontier.pop()
+            row = sq * N_SQUARES
+            for t in iter_bits(QUEEN_LINES[sq] & team_mask & ~reached):
+                if not BETWEEN[row + t] & opposing_mask:
+                    reached |= SQUARE_BITS[t]
+                    frontier.append(t)
+        return reached
 
     @staticmethod
-    def enumerate_options(ball_col, ball_row, opposing_pieces, team_pieces):
-        legal_moves = set()
-        for catch_col, catch_row in team_pieces:
-            if catch_col == ball_col and catch_row == ball_row:
-                continue
-            # First, lets see if it is horizontal or vertical and not blocked
-            if (catch_col == ball_col and ball_col not in [col for col, row in opposing_pieces if
-                                                           ball_row < row < catch_row or ball_row > row > catch_row]) or \
-                    (catch_row == ball_row and ball_row not in [row for col, row in opposing_pieces if
-                                                                ball_col < col < catch_col or ball_col > col > catch_col]):
-                legal_moves.add((catch_col, catch_row))
-            elif Rules.diagonal_move_available(ball_col, ball_row, catch_col, catch_row, opposing_pieces):
-                legal_moves.add((catch_col, catch_row))
-            else:
-                pass
-        return legal_moves
+    def single_ball_mask(state, player_idx):
+        """
+        Returns the mask of squares player_idx's ball can reach this turn through any number of passes
+        """
+        team_mask, opposing_mask = BitboardRules.player_masks(state, player_idx)
+        ball = state[5] if player_idx == 0 else state[11]
+        return BitboardRules.pass_closure(ball, team_mask, opposing_mask)
+
+    @staticmethod
+    def single_ball_actions(state, player_idx):
+        """
+        Returns the set of encoded positions player_idx's ball can move to this turn
+        """
+        return set(iter_bits(BitboardRules.single_ball_mask(state, player_idx)))
+
+    @staticmethod
+    def pass_reaches(ball, target, team_mask, opposing_mask):
+        """
+        Returns whether target can be reached from ball through any number of passes. Same search
+        as pass_closure, but it stops as soon as target is reached.
+        """
+        reached = 0
+        frontier = [ball]
+        while frontier:
+            sq = frontier.pop()
+            row = sq * N_SQUARES
+            for t in iter_bits(QUEEN_LINES[sq] & team_mask & ~reached):
+                if not BETWEEN[row + t] & opposing_mask:
+                    if t == target:
+                        return True
+                    reached |= SQUARE_BITS[t]
+                    frontier.append(t)
+        return False
+
+    @staticmethod
+    def check_action(state, action, player_idx):
+        """
+        Checks a single (relative_idx, encoded position) action for player_idx without generating
+        any other action: a knight offset and occupancy test for a block, a pass search that stops
+        at the target for the ball. Returns True if the action is in generate_valid_actions, and
+        raises ValueError naming the reason otherwise.
+        """
+        try:
+            rel_idx, target = action
+        except (TypeError, ValueError):
+            raise ValueError(f"Action {action!r} is not a (relative_idx, position) pair") from None
+        if player_idx not in (0, 1):
+            raise ValueError(f"Player {player_idx!r} is not 0 or 1")
+        if rel_idx not in range(6):
+            raise ValueError(f"Relative index {rel_idx!r} is not a piece: 0-4 are blocks and 5 is the ball")
+        if target not in range(N_SQUARES):
+            raise ValueError(f"Position {target!r} is not on the board")
+        rel_idx, target = int(rel_idx), int(target)
+        offset_idx = player_idx * 6
+        pos = state[offset_idx + rel_idx]
+
+        if rel_idx < 5:
+            if not KNIGHT_ATTACKS[pos] >> target & 1:
+                raise ValueError(f"Block {rel_idx} cannot move from {pos} to {target}: not a knight move")
+            if BitboardRules.occupancy(state) & SQUARE_BITS[target]:
+                raise ValueError(f"Block {rel_idx} cannot move to {target}: the square is occupied")
+            return True
+
+        if target == pos:
+            raise ValueError(f"The ball is already at {target}")
+        team_mask, opposing_mask = BitboardRules.player_masks(state, player_idx)
+        if not team_mask & SQUARE_BITS[target]:
+            raise ValueError(f"The ball cannot move to {target}: no block of its own team is there")
+        if not BitboardRules.pass_reaches(pos, target, team_mask, opposing_mask):
+            raise ValueError(f"The ball cannot reach {target}: every line of passes is blocked by the opponent")
+        return True
+
+    @staticmethod
+    def generate_valid_actions(state, player_idx):
+        """
+        Returns the set of (relative_idx, encoded position) actions for player_idx, matching
+        GameSimulator.generate_valid_actions
+        """
+        offset_idx = player_idx * 6
+        occupied = BitboardRules.occupancy(state)
+
+        all_actions = set()
+        for i in range(5):
+            pos = state[offset_idx + i]
+            # The piece's own square is never a knight target, so it can stay in the mask
+            for target in iter_bits(KNIGHT_ATTACKS[pos] & ~occupied):
+                all_actions.add((i, target))
+
+        for target in iter_bits(BitboardRules.single_ball_mask(state, player_idx)):
+            all_actions.add((5, target))
+
+        return all_actions
+
+
+class SearchBoard:
+    """
+    A single mutable board for the search to walk the game tree with. make_move changes the board
+    in place and unmake_move restores it, so no new state is built per node.
+
+    Alongside the encoded state and decoded coordinates, it keeps the block mask of each player
+    and the Zobrist hash of the position up to date.
+    """
+    __slots__ = ("state", "decode_state", "player_idx", "block_masks", "key")
+
+    def __init__(self, state, player_idx: int):
+        for i, pos in enumerate(state):
+            if not 0 <= pos < N_SQUARES:
+                raise ValueError(f"Position {pos} at index {i} is not on the board")
+        self.state = [int(pos) for pos in state]
+        self.decode_state = [DECODED_SQUARES[pos] for pos in self.state]
+        self.player_idx = player_idx
+        self.block_masks = [BitboardRules.occupancy(self.state[:5]), BitboardRules.occupancy(self.state[6:11])]
+        self.key = zobrist_hash(self.state, player_idx)
+
+    def position(self, idx: int):
+        return self.state[idx]
+
+    def to_packed(self):
+        return PackedState.from_state(self.state, self.player_idx)
+
+    def make_move(self, action: tuple):
+        """
+        Applies action, (relative_idx, position), for the player to move and passes the turn.
+        Returns the undo record to hand to unmake_move.
+        """
+        player_idx = self.player_idx
+        idx = player_idx * 6 + action[0]
+        old = self.state[idx]
+        new = action[1]
+        self.state[idx] = new
+        self.decode_state[idx] = DECODED_SQUARES[new]
+        if action[0] != 5:
+            self.block_masks[player_idx] ^= SQUARE_BITS[old] | SQUARE_BITS[new]
+        self.key ^= ZOBRIST_KEYS[idx][old] ^ ZOBRIST_KEYS[idx][new] ^ ZOBRIST_SIDE
+        self.player_idx = player_idx ^ 1
+        return idx, old, new
+
+    def unmake_move(self, undo: tuple):
+        """
+        Reverts the move make_move returned undo for
+        """
+        idx, old, new = undo
+        player_idx = self.player_idx ^ 1
+        self.state[idx] = old
+        self.decode_state[idx] = DECODED_SQUARES[old]
+        if idx % 6 != 5:
+            self.block_masks[player_idx] ^= SQUARE_BITS[old] | SQUARE_BITS[new]
+        self.key ^= ZOBRIST_KEYS[idx][old] ^ ZOBRIST_KEYS[idx][new] ^ ZOBRIST_SIDE
+        self.player_idx = player_idx
+
+    def generate_valid_actions(self):
+        """
+        Same actions as BitboardRules.generate_valid_actions for the player to move, read off the
+        cached block masks
+        """
+        counts = MOVEGEN_COUNTS.get()
+        if counts is not None:
+            counts["search_board"] += 1
+        state = self.state
+        player_idx = self.player_idx
+        offset_idx = player_idx * 6
+        own = self.block_masks[player_idx]
+        opposing = self.block_masks[player_idx ^ 1]
+        occupied = own | opposing | SQUARE_BITS[state[5]] | SQUARE_BITS[state[11]]
+
+        actions = []
+        for i in range(5):
+            for target in iter_bits(KNIGHT_ATTACKS[state[offset_idx + i]] & ~occupied):
+                actions.append((i, target))
+        ball = state[offset_idx + 5]
+        for target in iter_bits(BitboardRules.pass_closure(ball, own & ~SQUARE_BITS[ball], opposing)):
+            actions.append((5, target))
+        return actions
+
+    def is_termination_state(self):
+        """
+        Same check as BoardState.is_termination_state
+        """
+        white, black = self.block_masks
+        white_ball, black_ball = self.state[5], self.state[11]
+        if bin(white | black).count("1") != 10 or not white & SQUARE_BITS[white_ball] \
+                or not black & SQUARE_BITS[black_ball]:
+            return False
+        return white_ball >= 49 or black_ball <= 6
+
+
+class MoveLists:
+    """
+    The legal moves of a position, kept up to date across moves instead of generated again for
+    each one: the mask of target squares of every block, and the pass closure of each ball.
+
+    A move changes the occupancy of two squares, so only the moved block and the blocks a knight
+    move away from either square get their targets recomputed. A ball's closure depends on every
+    block of both teams, so both are dropped and rebuilt the next time they are asked for.
+    """
+
+    def __init__(self, state):
+        self.state = [int(pos) for pos in state]
+        self.occupied = BitboardRules.occupancy(self.state)
+        self.piece_masks = [KNIGHT_ATTACKS[pos] & ~self.occupied if i % 6 != 5 else 0
+                            for i, pos in enumerate(self.state)]
+        self.ball_masks = [None, None]
+
+    def matches(self, state):
+        """
+        Returns whether state, an encoded state, is the position these lists are for
+        """
+        return list(state) == self.state
+
+    def move(self, idx, pos):
+        """
+        Updates the lists for the entry at state index idx moving to pos
+        """
+        old = self.state[idx]
+        self.state[idx] = pos
+        self.occupied = BitboardRules.occupancy(self.state)
+        nearby = KNIGHT_ATTACKS[old] | KNIGHT_ATTACKS[pos]
+        for i, square in enumerate(self.state):
+            if i % 6 != 5 and (i == idx or nearby >> square & 1):
+                self.piece_masks[i] = KNIGHT_ATTACKS[square] & ~self.occupied
+        self.ball_masks = [None, None]
+
+    def actions(self, player_idx):
+        """
+        Returns the set of (relative_idx, encoded position) actions for player_idx, the same set
+        as BitboardRules.generate_valid_actions
+        """
+        counts = MOVEGEN_COUNTS.get()
+        if counts is not None:
+            counts["move_lists"] += 1
+        offset_idx = player_idx * 6
+        if self.ball_masks[player_idx] is None:
+            self.ball_masks[player_idx] = BitboardRules.single_ball_mask(self.state, player_idx)
+        all_actions = set()
+        for i in range(5):
+            for target in iter_bits(self.piece_masks[offset_idx + i]):
+                all_actions.add((i, target))
+        for target in iter_bits(self.ball_masks[player_idx]):
+            all_actions.add((5, target))
+        return all_actions
 
 
 class GameSimulator:
@@ -320,12 +879,21 @@ class GameSimulator:
         self.game_state = BoardState()
         self.current_round = -1  ## The game starts on round 0; white's move on EVEN rounds; black's move on ODD rounds
         self.players = players
+        # Legal moves of the current position, carried across update calls
+        self.move_lists = None
 
-    def run(self):
+    def run(self, verbose=True, max_rounds=None):
         """
         Runs a game simulation
+
+        With verbose=False nothing is printed. With max_rounds set, a game that is still going after
+        that many rounds ends as a "DRAW". The time each player took to choose its actions is
+        recorded in self.move_times as (player_idx, seconds) pairs.
         """
+        self.move_times = []
         while not self.game_state.is_termination_state():
+            if max_rounds is not None and self.current_round + 1 >= max_rounds:
+                return self.current_round, "DRAW", "Round limit reached"
 
             ## Determine the round number, and the player who needs to move
             self.current_round += 1
@@ -333,20 +901,43 @@ class GameSimulator:
 
             ## For the player who needs to move, provide them with the current game state
             ## and then ask them to choose an action according to their policy
+            start = time.perf_counter()
             action, value = self.players[player_idx].policy(self.game_state.make_state())
+            self.move_times.append((player_idx, time.perf_counter() - start))
+            result = self.play(action, value, player_idx, verbose)
+            if result is not None:
+                return result
+
+        return self.final_result(player_idx)
+
+    def play(self, action, value, player_idx, verbose):
+        """
+        Validates and plays the action a player chose this round. Returns the result of the game if
+        the action is invalid, otherwise None.
+        """
+        if verbose:
             print(
                 f"Round: {self.current_round} Player: {player_idx} State: {tuple(self.game_state.state)} Action: {action} Value: {value}")
 
-            if not self.validate_action(action, player_idx):
-                ## If an invalid action is provided, then the other player will be declared the winner
-                if player_idx == 0:
-                    return self.current_round, "BLACK", "White provided an invalid action"
-                else:
-                    return self.current_round, "WHITE", "Black probided an invalid action"
+        try:
+            valid = self.validate_action(action, player_idx)
+        except ValueError:
+            valid = False
+        if not valid:
+            ## If an invalid action is provided, then the other player will be declared the winner
+            if player_idx == 0:
+                return self.current_round, "BLACK", "White provided an invalid action"
+            else:
+                return self.current_round, "WHITE", "Black probided an invalid action"
 
-            ## Updates the game state
-            self.update(action, player_idx)
+        ## Updates the game state
+        self.update(action, player_idx)
+        return None
 
+    def final_result(self, player_idx):
+        """
+        Result of a game that ended with player_idx's move
+        """
         ## Player who moved last is the winner
         if player_idx == 0:
             return self.current_round, "WHITE", "No issues"
@@ -369,21 +960,14 @@ class GameSimulator:
               piece in the boardstate can be obtained, so relative_idx is the index relative to current player's
               pieces. Pieces with relative index 0,1,2,3,4 are block pieces that like knights in chess, and
               relative index 5 is the player's ball piece.
-        """
-        # Gets the correct indices depending on the player idx
-        indices = [i for i in range(5)] if player_idx == 0 else [i for i in range(6, 11)]
-
-        pieces_actions = [Rules.single_piece_actions(self.game_state, i) for i in indices]
 
-        all_actions = set()
-        for i, actions in enumerate(pieces_actions):
-            for action in actions:
-                all_actions.add((i, action))
-
-        for ball_action in Rules.single_ball_actions(self.game_state, player_idx):
-            all_actions.add((5, ball_action))
-
-        return all_actions
+        The move lists are kept across calls and updated by update (see MoveLists). If game_state
+        was changed some other way, they are built again from scratch.
+        """
+        state = self.game_state.state
+        if self.move_lists is None or not self.move_lists.matches(state):
+            self.move_lists = MoveLists(state)
+        return self.move_lists.actions(player_idx)
 
     def validate_action(self, action: tuple, player_idx: int):
         """
@@ -396,15 +980,12 @@ class GameSimulator:
 
         Output:
             - if the action is valid, return True
-            - if the action is not valid, raise ValueError
+            - if the action is not valid, raise ValueError naming the reason
 
+        Only the given action is checked (see BitboardRules.check_action), which gives the same
+        verdict as looking it up in generate_valid_actions.
         """
-        valid_actions = self.generate_valid_actions(player_idx)
-        if action in valid_actions:
-            return True
-        else:
-            raise ValueError(
-                "For each case that an action is not valid, specify the reason that the action is not valid in this ValueError.")
+        return BitboardRules.check_action(np.asarray(self.game_state.state).tolist(), action, player_idx)
 
     def update(self, action: tuple, player_idx: int):
         """
@@ -412,4 +993,51 @@ class GameSimulator:
         """
         offset_idx = player_idx * 6  ## Either 0 or 6
         idx, pos = action
+        if self.move_lists is not None and self.move_lists.matches(self.game_state.state):
+            self.move_lists.move(offset_idx + idx, int(pos))
+        else:
+            self.move_lists = None
         self.game_state.update(offset_idx + idx, pos)
+
+
+class AsyncGameSimulator(GameSimulator):
+    """
+    GameSimulator for players whose policy is a coroutine, such as engines in another process
+    (see remote.RemotePlayer). While a player is thinking the event loop runs other games, so a
+    single thread can host many games at once. Players with a plain policy are called directly,
+    which blocks the loop for as long as they take.
+    """
+
+    async def run(self, verbose=True, max_rounds=None):
+        """
+        Same as GameSimulator.run, awaiting each player's policy if it returns an awaitable
+        """
+        self.move_times = []
+        while not self.game_state.is_termination_state():
+            if max_rounds is not None and self.current_round + 1 >= max_rounds:
+                return self.current_round, "DRAW", "Round limit reached"
+
+            self.current_round += 1
+            player_idx = self.current_round % 2
+
+            start = time.perf_counter()
+            choice = self.players[player_idx].policy(self.game_state.make_state())
+            if inspect.isawaitable(choice):
+                choice = await choice
+            action, value = choice
+            self.move_times.append((player_idx, time.perf_counter() - start))
+            result = self.play(action, value, player_idx, verbose)
+            if result is not None:
+                return result
+
+        return self.final_result(player_idx)
+
+
+def run_games(simulators, verbose=False, max_rounds=None):
+    """
+    Runs every AsyncGameSimulator in simulators on one event loop and returns their results, in
+    the same order
+    """
+    async def run_all():
+        return await asyncio.gather(*(sim.run(verbose, max_rounds) for sim in simulators))
+    return asyncio.run(run_all())
@@ -0,0 +1,258 @@
+"""
+Monte Carlo tree search: an anytime alternative to the minimax in GameStateProblem, which only
+samples the lines it plays out instead of searching every move to a fixed depth.
+
+    players = [MCTSPlayer(0, time_budget=1.0, workers=4), AdversarialSearchPlayer(gsp, 1)]
+    GameSimulator(players).run()
+
+Children are chosen by UCT, except that a node whose player to move has a winning pass gets that
+pass as its only child. Each new node is scored by a short rollout: random moves (or, with
+rollout="heuristic", a winning pass whenever the player to move has one) until the game ends or
+ROLLOUT_PLIES plies have been played, after which the position is scored with calc_h. The tree is
+kept between moves, and the search carries on from the node of the new position if it was already
+in the tree.
+
+With workers, `workers` tasks each grow a worker process's tree from the root for the same budget,
+and the visits each task added to the root actions are added up (root parallelisation).
+"""
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import BoardState, PackedState, Player, legal_actions
+from search import calc_h, winning_passes
+
+# UCT exploration constant
+EXPLORATION = math.sqrt(2)
+# Plies played out from a new node before the position is scored instead
+ROLLOUT_PLIES = 8
+# calc_h difference at which a rollout that did not finish counts as three quarters of a win
+ROLLOUT_SCALE = 10.0
+
+
+class Node:
+    """
+    A position in the search tree. wins adds up the rollout results for the player who moved into
+    this position, so a parent picks the child with the best wins / visits for itself.
+    """
+    __slots__ = ("key", "parent", "action", "children", "untried", "visits", "wins")
+
+    def __init__(self, key, parent=None, action=None):
+        self.key = key
+        self.parent = parent
+        self.action = action
+        self.children = []
+        # Actions not expanded yet; generated on the first visit
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+
+    def uct_child(self, exploration):
+        log_visits = math.log(self.visits)
+        return max(self.children,
+                   key=lambda child: child.wins / child.visits + exploration * math.sqrt(log_visits / child.visits))
+
+
+class MCTS:
+    """
+    The search tree and its settings. rollout is "random" or "heuristic"; seed makes the search
+    reproducible for a fixed number of iterations.
+    """
+
+    def __init__(self, exploration=EXPLORATION, rollout="random", rollout_plies=ROLLOUT_PLIES, seed=None):
+        if rollout not in ("random", "heuristic"):
+            raise ValueError(f"Unknown rollout policy: {rollout}")
+        self.exploration = exploration
+        self.rollout_policy = rollout
+        self.rollout_plies = rollout_plies
+        self.rng = random.Random(seed)
+        self.root = None
+        self.iterations = 0
+
+    def set_root(self, key):
+        """
+        Moves the root to the position with PackedState key `key`. The subtree below it is kept if
+        the position is the current root or one or two plies below it.
+        """
+        if self.root is not None:
+            layer = [self.root]
+            for _ in range(3):
+                for node in layer:
+                    if node.key == key:
+                        node.parent = None
+                        node.action = None
+                        self.root = node
+                        return
+                layer = [child for node in layer for child in node.children]
+        self.root = Node(key)
+
+    def search(self, key, iterations=None, time_budget=None):
+        """
+        Grows the tree from the position with PackedState key `key` for `iterations` iterations or
+        until time_budget seconds have passed, whichever comes first (at least one must be set).
+        Returns the root node.
+        """
+        if iterations is None and time_budget is None:
+            raise ValueError("MCTS needs an iteration budget, a time budget, or both")
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        self.set_root(key)
+        self.iterations = 0
+        while iterations is None or self.iterations < iterations:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            self.iterate()
+            self.iterations += 1
+        return self.root
+
+    def iterate(self):
+        """
+        One selection, expansion, rollout and backpropagation step
+        """
+        node = self.root
+        while node.untried is not None and not node.untried and node.children:
+            node = node.uct_child(self.exploration)
+
+        state = PackedState(node.key)
+        if node.untried is None:
+            passes = [] if state.is_termination_state() else winning_passes(state)
+            if passes:
+                # A player who can win this turn does, so the other actions are never searched
+                node.untried = passes[:1]
+            elif state.is_termination_state():
+                node.untried = []
+            else:
+                node.untried = sorted(legal_actions(state.state, state.player_idx))
+                self.rng.shuffle(node.untried)
+        if node.untried:
+            action = node.untried.pop()
+            state = state.execute(action)
+            child = Node(state.key, node, action)
+            node.children.append(child)
+            node = child
+
+        result = self.rollout(state)
+        while node is not None:
+            node.visits += 1
+            node.wins += result
+            result = 1.0 - result
+            node = node.parent
+
+    def rollout(self, state):
+        """
+        Plays state, a PackedState, out and returns the result for the player who moved into it:
+        1 for a win, 0 for a loss, and in between for a rollout cut off after rollout_plies plies
+        """
+        mover = 1 - state.player_idx
+        for _ in range(self.rollout_plies):
+            if state.is_termination_state():
+                # The player who moved last wins
+                return 1.0 if state.player_idx != mover else 0.0
+            if self.rollout_policy == "heuristic" and winning_passes(state):
+                return 1.0 if state.player_idx == mover else 0.0
+            actions = legal_actions(state.state, state.player_idx)
+            if not actions:
+                break
+            state = state.execute(self.rng.choice(sorted(actions)))
+        if state.is_termination_state():
+            return 1.0 if state.player_idx != mover else 0.0
+        # calc_h scores the side of the player who did not move last when is_max is set, so
+        # player_idx=1 gives white's score and player_idx=0 black's
+        white, black = float(calc_h(state, 1, True)), float(calc_h(state, 0, True))
+        lead = white - black if mover == 0 else black - white
+        return 0.5 + 0.5 * math.tanh(lead / ROLLOUT_SCALE)
+
+
+def root_statistics(root):
+    """
+    Returns {action: (visits, wins)} for the children of root
+    """
+    return {child.action: (child.visits, child.wins) for child in root.children}
+
+
+def best_action(statistics):
+    """
+    Picks the most visited action from root statistics, breaking ties by the lowest action, and
+    returns (action, win rate)
+    """
+    action = max(sorted(statistics), key=lambda a: statistics[a][0])
+    visits, wins = statistics[action]
+    return action, wins / visits
+
+
+class MCTSPlayer(Player):
+    def __init__(self, player_idx, iterations=1000, time_budget=None, workers=0, seed=None, **mcts_kwargs):
+        # Searches for `iterations` iterations or time_budget seconds per move, whichever runs out
+        # first (set either to None to only use the other). With workers, each of `workers`
+        # processes searches for the whole budget on its own tree. mcts_kwargs go to MCTS.
+        super().__init__(self.search)
+        self.b = BoardState()
+        self.player_idx = player_idx
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.workers = workers
+        self.seed = seed
+        self.mcts_kwargs = mcts_kwargs
+        self.engine = MCTS(seed=seed, **mcts_kwargs)
+        self.executor = None
+        self.moves = 0
+
+    def policy(self, decode_state):
+        encoded_state_tup = tuple(self.b.encode_single_pos(s) for s in decode_state)
+        return self.policy_fnc(PackedState.from_tuple((encoded_state_tup, self.player_idx)).key)
+
+    def search(self, key):
+        """
+        Returns (action, win rate) for the position with PackedState key `key`
+        """
+        self.moves += 1
+        if not self.workers:
+            return best_action(root_statistics(self.engine.search(key, self.iterations, self.time_budget)))
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_mcts_worker,
+                                                initargs=(self.mcts_kwargs,))
+        base_seed = 0 if self.seed is None else self.seed
+        futures = [self.executor.submit(_search_worker_tree, key, self.iterations, self.time_budget,
+                                        (base_seed, self.moves, i))
+                   for i in range(self.workers)]
+        statistics = {}
+        for future in futures:
+            for action, (visits, wins) in future.result().items():
+                total_visits, total_wins = statistics.get(action, (0, 0.0))
+                statistics[action] = (total_visits + visits, total_wins + wins)
+        return best_action(statistics)
+
+    def close(self):
+        """
+        Shuts down the worker processes, if any were started
+        """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+# Worker process state for MCTSPlayer.search
+_worker_engine = None
+
+
+def _init_mcts_worker(mcts_kwargs):
+    global _worker_engine
+    _worker_engine = MCTS(**mcts_kwargs)
+
+
+def _search_worker_tree(key, iterations, time_budget, seed):
+    """
+    Searches the position with PackedState key `key` on this worker's tree. Returns the root
+    statistics (see root_statistics) of this call alone: the pool may hand several tasks for the
+    same move to one worker, and each must only report the visits it added to the shared tree.
+    """
+    _worker_engine.rng.seed(str(seed))
+    _worker_engine.set_root(key)
+    before = root_statistics(_worker_engine.root)
+    statistics = {}
+    for action, (visits, wins) in root_statistics(_worker_engine.search(key, iterations, time_budget)).items():
+        old_visits, old_wins = before.get(action, (0, 0.0))
+        if visits > old_visits:
+            statistics[action] = (visits - old_visits, wins - old_wins)
+    return statistics
@@ -0,0 +1,86 @@
+"""
+Perft: counts the positions reachable in exactly `depth` plies, as a correctness check and a speed
+benchmark for move generation.
+
+    python perft.py --depth 4
+
+Actions come from GameSimulator.generate_valid_actions and moves are made with
+GameStateProblem.execute, the same calls the game and the planners rely on. A position where the
+game is over has no moves, so it only counts when it is reached at exactly `depth` plies.
+"""
+import argparse
+import time
+
+from game import BoardState, GameSimulator
+from search import GameStateProblem
+
+START_STATE = (1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52)
+
+# (name, (encoded_state, player_idx), {depth: positions}). The counts were produced by the original
+# list based rules, so they also pin down the behaviour of every faster rewrite.
+PERFT_POSITIONS = [
+    ("start", (START_STATE, 0), {1: 22, 2: 484, 3: 11176, 4: 257900}),
+    ("midgame", ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 0), {1: 26, 2: 517, 3: 13868, 4: 299541}),
+    ("crossed", ((44, 37, 46, 41, 40, 37, 8, 15, 52, 11, 5, 15), 0), {1: 29, 2: 720, 3: 19659, 4: 473945}),
+    ("black_to_move", ((44, 37, 46, 41, 40, 41, 1, 2, 52, 4, 5, 52), 1), {1: 17, 2: 492, 3: 9563, 4: 262411}),
+]
+
+
+def perft(sim, gsp, state, depth):
+    """
+    Returns the number of positions reached from state, an (encoded_state, player_idx) tuple, in
+    exactly depth plies. sim.game_state is used as scratch space for each position visited.
+    """
+    encoded_state, player_idx = state
+    board = sim.game_state
+    board.state = encoded_state
+    if depth == 0:
+        return 1
+    if board.is_termination_state():
+        return 0
+    actions = sim.generate_valid_actions(player_idx)
+    if depth == 1:
+        return len(actions)
+    return sum(perft(sim, gsp, gsp.execute(state, action), depth - 1) for action in actions)
+
+
+def run_perft(state, depth):
+    """
+    Runs perft from state to each depth from 1 to depth. Returns a list of
+    (depth, positions, seconds) tuples.
+    """
+    b = BoardState()
+    sim = GameSimulator([None, None])
+    gsp = GameStateProblem(b, b, state[1], verbose=False)
+    results = []
+    for d in range(1, depth + 1):
+        start = time.perf_counter()
+        positions = perft(sim, gsp, state, d)
+        results.append((d, positions, time.perf_counter() - start))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count positions reachable from the perft positions")
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for name, state, known in PERFT_POSITIONS:
+        for depth, positions, seconds in run_perft(state, args.depth):
+            expected = known.get(depth)
+            if expected is None:
+                check = ""
+            elif expected == positions:
+                check = "ok"
+            else:
+                check = f"MISMATCH, expected {expected}"
+                failed = True
+            nps = positions / seconds if seconds else 0.0
+            print(f"{name:<14} depth {depth}: {positions:>10} positions {seconds:8.3f}s {nps:12.0f} nps  {check}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Out-of-process players for AsyncGameSimulator: an engine runs in a subprocess and answers move
+requests over its stdin and stdout, so a game waiting on it only holds a pending future.
+
+    engine = EngineProcess(engine_command(plies=2))
+    sims = [AsyncGameSimulator([RemotePlayer(0, engine), RemotePlayer(1, engine)]) for _ in range(100)]
+    run_games(sims)
+
+One line per request and per reply, fields separated by spaces:
+
+    request: <request id> <12 encoded positions> <player_idx>
+    reply:   <request id> <relative_idx> <encoded position> <value or None>
+
+Requests carry an id so that many games can share one engine process. The engine answers them
+one at a time, in order; start several EngineProcesses to use more cores.
+
+    python remote.py --plies 2     # serve an engine on stdin/stdout (plies 0 plays randomly)
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from game import BoardState, Player
+from tournament import engine_factory
+
+
+def engine_command(plies=2, seed=0):
+    """
+    Command line that serves an engine from this module, for EngineProcess
+    """
+    return [sys.executable, os.path.abspath(__file__), "--plies", str(plies), "--seed", str(seed)]
+
+
+class EngineProcess:
+    """
+    An engine subprocess started from `command`, shared by any number of RemotePlayers. It is
+    started on the first request.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.reader = None
+        self.pending = {}
+        self.next_id = 0
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE,
+                                                            stdout=asyncio.subprocess.PIPE)
+        self.reader = asyncio.create_task(self.read_replies())
+
+    async def read_replies(self):
+        """
+        Resolves the pending request of each reply, and fails the rest if the process exits
+        """
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            request_id, rel_idx, pos, value = line.split()
+            future = self.pending.pop(int(request_id))
+            if not future.done():
+                future.set_result(((int(rel_idx), int(pos)), None if value == b"None" else float(value)))
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Engine process {self.command} exited"))
+        self.pending.clear()
+
+    async def request(self, encoded_state, player_idx):
+        """
+        Asks the engine for player_idx's move in encoded_state. Returns (action, value).
+        """
+        async with self.lock:
+            if self.process is None:
+                await self.start()
+            if self.process.returncode is not None:
+                raise RuntimeError(f"Engine process {self.command} exited")
+            request_id = self.next_id
+            self.next_id += 1
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = future
+            fields = [request_id, *encoded_state, player_idx]
+            self.process.stdin.write((" ".join(str(int(field)) for field in fields) + "\n").encode())
+            await self.process.stdin.drain()
+        return await future
+
+    async def close(self):
+        """
+        Closes the engine's input, which ends the process, and waits for it to exit
+        """
+        if self.process is not None:
+            self.process.stdin.close()
+            await self.process.wait()
+            await self.reader
+            self.process = None
+
+
+class RemotePlayer(Player):
+    def __init__(self, player_idx, engine):
+        # Gets its moves from engine, an EngineProcess; policy is a coroutine, so this player
+        # needs an AsyncGameSimulator.
+        super().__init__(engine.request)
+        self.b = BoardState()
+        self.player_idx = player_idx
+
+    async def policy(self, decode_state):
+        encoded_state = [self.b.encode_single_pos(s) for s in decode_state]
+        return await self.policy_fnc(encoded_state, self.player_idx)
+
+
+def serve(player_factory, seed, requests=None, replies=None):
+    """
+    Answers move requests from `requests` on `replies` (stdin and stdout by default) until the
+    input ends. Each player_idx gets its own player, made by player_factory(player_idx, seed) on
+    its first request.
+    """
+    requests = sys.stdin if requests is None else requests
+    replies = sys.stdout if replies is None else replies
+    b = BoardState()
+    players = {}
+    for line in requests:
+        fields = line.split()
+        if not fields:
+            continue
+        request_id, *encoded_state, player_idx = (int(field) for field in fields)
+        if player_idx not in players:
+            players[player_idx] = player_factory(player_idx, seed)
+        action, value = players[player_idx].policy([b.decode_single_pos(pos) for pos in encoded_state])
+        value = "None" if value is None else repr(float(value))
+        replies.write(f"{request_id} {int(action[0])} {int(action[1])} {value}\n")
+        replies.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an engine over stdin and stdout")
+    parser.add_argument("--plies", type=int, default=2, help="search depth (0 plays randomly)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    serve(engine_factory(args.plies), args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,422 @@
 import heapq
-from collections import deque
+import multiprocessing
+from array import array
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, deque, OrderedDict
 import numpy as np
 import queue
-from game import BoardState, GameSimulator, Rules
+from game import BitboardRules, BoardState, GameSimulator, PackedState, Rules, SearchBoard, count_movegen, legal_actions, zobrist_hash
+from game import BETWEEN, KNIGHT_ATTACKS, KNIGHT_DISTANCE, N_COLS, N_SQUARES, PLAYER_SHIFT, QUEEN_LINES, SQUARE_BITS, iter_bits
+from game import ZOBRIST_KEYS, ZOBRIST_SIDE
+
+# Heuristic values are rounded to 3 decimals, so anything below that separates a tie from a loss
+TIE_EPSILON = 1e-6
+# Value of a position the tablebase proves won for the root player, less the plies to the win.
+# It is far above anything calc_h returns.
+WIN_SCORE = 1000
+
+# Iterative deepening gives up at this depth even if time remains
+MAX_PLIES = 64
+# The deadline is checked once every DEADLINE_CHECK_MASK + 1 nodes
+DEADLINE_CHECK_MASK = 255
+
+# The same position is worth different amounts at max and min nodes, so max nodes get their own key
+ZOBRIST_MAXIMIZING = 0x9E3779B97F4A7C15
+
+# Multipliers for hashing 73 bit PackedState keys into table slots and Bloom filter bits
+KEY_MASK_64 = (1 << 64) - 1
+KEY_HASH_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F)
+# A* frontier entries pack (f, -g, count, key) into one int, which sorts the same way as the tuple
+KEY_BITS = PLAYER_SHIFT + 1
+KEY_MASK = (1 << KEY_BITS) - 1
+FRONTIER_COUNT_BITS = 40
+FRONTIER_G_MASK = (1 << 16) - 1
+FRONTIER_G_SHIFT = KEY_BITS + FRONTIER_COUNT_BITS
+
+
+def _build_score_table(player_idx):
+    """
+    calc_h's score for player_idx's opponent only depends on the sum of that player's block rows,
+    how many blocks are on the goal row and whether the ball is on the goal row. This tabulates it
+    for every combination, computed the same way calc_h does, at index (row_sum * 6 + count) * 2 + ball.
+    """
+    table = []
+    for row_sum in range(5 * 7 + 1):
+        for count in range(6):
+            for ball in range(2):
+                mean = np.float64(row_sum) / 5
+                score = mean if player_idx == 0 else 7 - mean
+                for _ in range(count):
+                    score += 7
+                if ball:
+                    score += 20
+                table.append(round(score, 3))
+    return tuple(table)
+
+
+# SCORE_TABLES[0] scores white's progress and SCORE_TABLES[1] black's
+SCORE_TABLES = (_build_score_table(0), _build_score_table(1))
+# Row of each player's goal
+GOAL_ROWS = (7, 0)
+# Mask of the squares on each player's goal row
+GOAL_ROW_MASKS = tuple(sum(SQUARE_BITS[row * N_COLS + col] for col in range(N_COLS)) for row in GOAL_ROWS)
+
+
+class IncrementalEvaluator:
+    """
+    Keeps the terms of calc_h for one position (per player: the sum of block rows, the number of
+    blocks on the goal row and whether the ball is on the goal row) and updates them in O(1) as
+    moves are made and unmade, so a leaf can be scored without looking at the whole state.
+    """
+    __slots__ = ("row_sums", "goal_counts", "ball_goals")
+
+    def __init__(self, state):
+        self.row_sums = [0, 0]
+        self.goal_counts = [0, 0]
+        self.ball_goals = [0, 0]
+        for player_idx in range(2):
+            offset_idx = player_idx * 6
+            for pos in state[offset_idx:offset_idx + 5]:
+                row = pos // N_COLS
+                self.row_sums[player_idx] += row
+                self.goal_counts[player_idx] += row == GOAL_ROWS[player_idx]
+            self.ball_goals[player_idx] = int(state[offset_idx + 5] // N_COLS == GOAL_ROWS[player_idx])
+
+    def make(self, idx, old, new):
+        """
+        Updates the terms for the piece at index idx moving from encoded position old to new
+        """
+        player_idx, rel_idx = divmod(idx, 6)
+        goal_row = GOAL_ROWS[player_idx]
+        old_row, new_row = old // N_COLS, new // N_COLS
+        if rel_idx == 5:
+            self.ball_goals[player_idx] = int(new_row == goal_row)
+        else:
+            self.row_sums[player_idx] += new_row - old_row
+            self.goal_counts[player_idx] += (new_row == goal_row) - (old_row == goal_row)
+
+    def unmake(self, idx, old, new):
+        """
+        Reverts make(idx, old, new)
+        """
+        self.make(idx, new, old)
+
+    def score(self, player_idx, is_max):
+        """
+        Returns calc_h(state, player_idx, is_max) for the current position
+        """
+        scored = 0 if player_idx == 1 else 1
+        score = SCORE_TABLES[scored][(self.row_sums[scored] * 6 + self.goal_counts[scored]) * 2
+                                     + self.ball_goals[scored]]
+        return score if is_max else -score
+
+    def score_after(self, idx, old, new, player_idx, is_max):
+        """
+        Returns score(player_idx, is_max) as it would be after make(idx, old, new), without changing anything
+        """
+        scored = 0 if player_idx == 1 else 1
+        row_sum, goal_count, ball_goal = self.row_sums[scored], self.goal_counts[scored], self.ball_goals[scored]
+        if idx // 6 == scored:
+            goal_row = GOAL_ROWS[scored]
+            old_row, new_row = old // N_COLS, new // N_COLS
+            if idx % 6 == 5:
+                ball_goal = int(new_row == goal_row)
+            else:
+                row_sum += new_row - old_row
+                goal_count += (new_row == goal_row) - (old_row == goal_row)
+        score = SCORE_TABLES[scored][(row_sum * 6 + goal_count) * 2 + ball_goal]
+        return score if is_max else -score
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the iterative deepening deadline has passed
+    """
+    pass
+
+
+class SearchStats:
+    """
+    What one call of GameStateProblem.adversarial_search_method did:
+        - nodes: positions visited, leaves included, and leaves: positions that were scored
+        - expanded: positions whose actions were generated, and children: how many actions they had
+        - cutoffs: alpha/beta cutoffs, and nodes_pruned: actions skipped because of them
+        - tt_probes and tt_hits: transposition table lookups, and how many found an entry
+        - tablebase_hits: positions whose outcome was read from the tablebase
+        - cache_hits: transposition table misses that were found in the persistent cache
+        - depth_times: a (depth, seconds, nodes) tuple for each completed depth, with the time and
+          nodes of that depth alone
+        - wall_time: seconds for the whole call
+        - movegen: counts of move generation calls by function, when counted (see
+          GameStateProblem.stats_hook), otherwise None
+
+    With root-parallel search the counters include the work done in the worker processes, apart
+    from movegen, which only covers this process.
+    """
+
+    def __init__(self, nodes=0, leaves=0, expanded=0, children=0, cutoffs=0, nodes_pruned=0, tt_probes=0,
+                 tt_hits=0, depth_times=None, wall_time=0.0, movegen=None, tablebase_hits=0, cache_hits=0):
+        self.nodes = nodes
+        self.leaves = leaves
+        self.expanded = expanded
+        self.children = children
+        self.cutoffs = cutoffs
+        self.nodes_pruned = nodes_pruned
+        self.tt_probes = tt_probes
+        self.tt_hits = tt_hits
+        self.tablebase_hits = tablebase_hits
+        self.cache_hits = cache_hits
+        self.depth_times = [] if depth_times is None else depth_times
+        self.wall_time = wall_time
+        self.movegen = movegen
+
+    @property
+    def branching_factor(self):
+        return self.children / self.expanded if self.expanded else 0.0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def nps(self):
+        return self.nodes / self.wall_time if self.wall_time else 0.0
+
+    def __repr__(self):
+        depths = ", ".join(f"{depth}: {seconds * 1000:.1f}ms" for depth, seconds, _ in self.depth_times)
+        return (f"SearchStats(nodes={self.nodes}, leaves={self.leaves}, branching={self.branching_factor:.1f}, "
+                f"cutoffs={self.cutoffs}, pruned={self.nodes_pruned}, tt_hit_rate={self.tt_hit_rate:.2f}, "
+                f"tablebase_hits={self.tablebase_hits}, cache_hits={self.cache_hits}, "
+                f"nps={self.nps:.0f}, depths=[{depths}], movegen={self.movegen})")
+
+
+class TranspositionTable:
+    """
+    A fixed-capacity cache of searched positions, keyed by Zobrist hash. Each entry is a tuple
+    (depth, flag, value, best_action), where depth is the number of plies searched below the
+    position and flag says whether value is EXACT, a LOWER bound or an UPPER bound.
+
+    policy is either:
+        - "depth": a direct-mapped table of `size` slots. A slot is overwritten by entries from a
+          newer search, or by entries searched at least as deep as the one it holds.
+        - "lru": holds up to `size` entries and evicts the least recently used one.
+    """
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, size=1 << 16, policy="depth"):
+        if policy not in ("depth", "lru"):
+            raise ValueError(f"Unknown transposition table policy: {policy}")
+        self.size = size
+        self.policy = policy
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.clear()
+
+    def clear(self):
+        if self.policy == "depth":
+            self.slots = [None] * self.size
+        else:
+            self.slots = OrderedDict()
+
+    def new_search(self):
+        """
+        Marks existing entries as coming from an earlier search, so they are replaced first
+        """
+        self.generation += 1
+
+    def probe(self, key):
+        """
+        Returns the entry stored for key, or None
+        """
+        self.probes += 1
+        if self.policy == "depth":
+            slot = self.slots[key % self.size]
+            if slot is None or slot[0] != key:
+                return None
+            entry = slot[1]
+        else:
+            entry = self.slots.get(key)
+            if entry is None:
+                return None
+            self.slots.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, key, depth, flag, value, best_action):
+        entry = (depth, flag, value, best_action)
+        if self.policy == "depth":
+            idx = key % self.size
+            slot = self.slots[idx]
+            if slot is None or slot[0] == key or slot[2] != self.generation or depth >= slot[1][0]:
+                self.slots[idx] = (key, entry, self.generation)
+        else:
+            self.slots[key] = entry
+            self.slots.move_to_end(key)
+            if len(self.slots) > self.size:
+                self.slots.popitem(last=False)
+
+    def __len__(self):
+        if self.policy == "depth":
+            return sum(1 for slot in self.slots if slot is not None)
+        return len(self.slots)
+
+
+def mix_key(key, multiplier):
+    """
+    Mixes a PackedState key (up to 73 bits) into 64 well spread bits
+    """
+    return ((key ^ (key >> 64)) * multiplier & KEY_MASK_64) ^ (key >> 37)
+
+
+class StateDict(dict):
+    """
+    Planner bookkeeping: maps PackedState keys to (cost, parent_key, action) entries. parent_key and
+    action are None for the states a search starts from.
+    """
+
+    def put(self, key, cost, parent_key, action):
+        self[key] = (cost, parent_key, action)
+
+
+class StateTable:
+    """
+    Array-backed alternative to StateDict, with the same get / put interface.
+
+    Entries are appended to typed arrays: the key split into its low 64 and high bits, the cost,
+    the parent's entry number and the action as relative_idx * N_SQUARES + position. That is 20
+    bytes a state. They are found through an open-addressing index of entry numbers, probed
+    linearly and kept at most two thirds full, which adds 6 to 12 bytes a state. A dict of state
+    tuples needs several hundred bytes a state.
+    """
+
+    def __init__(self, capacity=1 << 12):
+        self.keys_low = array("Q")
+        self.keys_high = array("H")
+        self.costs = array("H")
+        self.parents = array("i")
+        self.actions = array("H")
+        bits = max(capacity * 3 // 2, 8).bit_length()
+        self.shift = 64 - bits
+        self.index = array("i", [-1]) * (1 << bits)
+
+    def __len__(self):
+        return len(self.costs)
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def slot(self, key):
+        """
+        Returns the index slot that holds key's entry number, or the empty slot where it would go
+        """
+        mask = len(self.index) - 1
+        low, high = key & KEY_MASK_64, key >> 64
+        slot = mix_key(key, KEY_HASH_MULTIPLIERS[0]) >> self.shift
+        while True:
+            entry = self.index[slot]
+            if entry < 0 or (self.keys_low[entry] == low and self.keys_high[entry] == high):
+                return slot
+            slot = (slot + 1) & mask
+
+    def find(self, key):
+        """
+        Returns the entry number of key, or -1
+        """
+        return self.index[self.slot(key)]
+
+    def key(self, entry):
+        return self.keys_low[entry] | (self.keys_high[entry] << 64)
+
+    def get(self, key):
+        """
+        Returns the (cost, parent_key, action) entry for key, or None
+        """
+        entry = self.find(key)
+        if entry < 0:
+            return None
+        parent = self.parents[entry]
+        if parent < 0:
+            return self.costs[entry], None, None
+        return self.costs[entry], self.key(parent), divmod(self.actions[entry], N_SQUARES)
+
+    def put(self, key, cost, parent_key, action):
+        """
+        Adds or replaces the entry for key. parent_key must already have an entry.
+        """
+        parent = -1 if parent_key is None else self.find(parent_key)
+        packed_action = 0 if action is None else action[0] * N_SQUARES + action[1]
+        slot = self.slot(key)
+        entry = self.index[slot]
+        if entry >= 0:
+            self.costs[entry] = cost
+            self.parents[entry] = parent
+            self.actions[entry] = packed_action
+            return
+        self.index[slot] = len(self.costs)
+        self.keys_low.append(key & KEY_MASK_64)
+        self.keys_high.append(key >> 64)
+        self.costs.append(cost)
+        self.parents.append(parent)
+        self.actions.append(packed_action)
+        if len(self.costs) * 3 > len(self.index) * 2:
+            self.grow()
+
+    def grow(self):
+        """
+        Doubles the index and re-inserts every entry number
+        """
+        self.shift -= 1
+        self.index = array("i", [-1]) * (len(self.index) * 2)
+        mask = len(self.index) - 1
+        for entry in range(len(self.costs)):
+            slot = mix_key(self.key(entry), KEY_HASH_MULTIPLIERS[0]) >> self.shift
+            while self.index[slot] >= 0:
+                slot = (slot + 1) & mask
+            self.index[slot] = entry
+
+    def memory_bytes(self):
+        """
+        Bytes held by the arrays
+        """
+        arrays = (self.keys_low, self.keys_high, self.costs, self.parents, self.actions, self.index)
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays)
+
+
+class BloomFilter:
+    """
+    Approximate set of PackedState keys in a fixed array of n_bits bits. A key that was added is
+    always reported present. A key that was not added is reported present with a probability of
+    about (1 - e^(-n_hashes * n / n_bits))^n_hashes after n adds.
+    """
+
+    def __init__(self, n_bits=1 << 24, n_hashes=4):
+        self.bits = (max(n_bits, 8) - 1).bit_length()
+        self.n_hashes = n_hashes
+        self.array = bytearray(1 << (self.bits - 3))
+        self.count = 0
+
+    def positions(self, key):
+        mask = (1 << self.bits) - 1
+        h1 = mix_key(key, KEY_HASH_MULTIPLIERS[0])
+        h2 = mix_key(key, KEY_HASH_MULTIPLIERS[1]) | 1
+        return [(h1 + i * h2) & mask for i in range(self.n_hashes)]
+
+    def add(self, key):
+        for pos in self.positions(key):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        array = self.array
+        for pos in self.positions(key):
+            if not array[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
 
 
 class Problem:
@@ -32,19 +446,72 @@ class Problem:
 
 class GameStateProblem(Problem):
 
-    def __init__(self, initial_board_state, goal_board_state, player_idx):
+    def __init__(self, initial_board_state, goal_board_state, player_idx, tt_size=1 << 16, tt_policy="depth",
+                 workers=0, verbose=True, stats_hook=None, tablebase=None, tt_cache=None, tactics=False):
         """
         player_idx is 0 or 1, depending on which player will be first to move from this initial state.
 
         The form of initial state is:
         ((game board state tuple), player_idx ) <--- indicates state of board and who's turn it is to move
+
+        tt_size and tt_policy configure the transposition table used by the adversarial search
+        (see TranspositionTable). With workers > 0 the root actions are searched in parallel by a
+        pool of that many processes (see search_root_parallel); call close() to shut it down.
+        With verbose=False the search does not print the best root moves after each call.
+
+        Every search leaves a SearchStats in self.stats, and passes it to stats_hook(stats) if one is
+        set. Move generation calls are only counted while a stats_hook is set.
+
+        tablebase is an optional tablebase.Tablebase. The adversarial search looks every position it
+        reaches up in it, and stops at the ones with a proven outcome (see tablebase_value).
+
+        tt_cache is an optional ttcache.TTCache. Positions missing from the transposition table are
+        looked up in it, and every entry stored in the table is written through to it, so searches
+        in other processes and later runs can reuse them.
+
+        With tactics, the adversarial search checks the root for a pass that wins at once, and for
+        a winning pass the opponent is threatening, before searching (see adversarial_search_method).
         """
         super().__init__(tuple((tuple(initial_board_state.state), player_idx)),
                          set([tuple((tuple(goal_board_state.state), 0)), tuple((tuple(goal_board_state.state), 1))]))
+        # get_actions calls legal_actions directly; sim is kept for code that still uses gsp.sim
         self.sim = GameSimulator(None)
         self.search_alg_fnc = None
         self.set_search_alg()
 
+        # Move ordering state for alpha-beta: up to two killer moves per ply, and a history
+        # score per (player_idx, action) that grows each time the action causes a cutoff
+        self.killers = {}
+        self.history = {}
+        self.nodes_pruned = 0
+        self.tt = TranspositionTable(tt_size, tt_policy)
+        # Search counters, reset by new_search and collected into self.stats after each search
+        self.nodes = 0
+        self.leaves = 0
+        self.expanded = 0
+        self.children = 0
+        self.cutoffs = 0
+        self.tablebase_hits = 0
+        self.cache_hits = 0
+        self.stats = None
+        self.stats_hook = stats_hook
+        # calc_h terms for the position currently being searched
+        self.evaluator = None
+
+        # Wall-clock deadline for the iterative deepening search, only enforced while deadline_active
+        self.deadline = None
+        self.deadline_active = False
+        self.completed_depth = 0
+        self.ponder_thread = None
+
+        self.workers = workers
+        self.executor = None
+        self.shared_alpha = None
+        self.verbose = verbose
+        self.tablebase = tablebase
+        self.tt_cache = tt_cache
+        self.tactics = tactics
+
     def set_search_alg(self, alg=""):
         """
         If you decide to implement several search algorithms, and you wish to switch between them,
@@ -52,9 +519,25 @@ class GameStateProblem(Problem):
             self.search_alg_fnc = self.your_method
         to indicate which algorithm you'd like to run.
 
-        TODO: You need to set self.search_alg_fnc here
+        alg is one of:
+            - "" or "astar": A* with planning_h as the heuristic (the default)
+            - "ucs": uniform cost search, A* with no heuristic
+            - "bidirectional": breadth-first search from both ends, meeting in the middle
+            - "astar-table" and "astar-bloom": A* keeping its visited states in a StateTable, or
+              approximately in a BloomFilter (see a_star_search)
         """
-        self.search_alg_fnc = self.adversarial_search_method
+        if alg in ("", "astar"):
+            self.search_alg_fnc = self.a_star_search
+        elif alg == "ucs":
+            self.search_alg_fnc = lambda: self.a_star_search(heuristic=False)
+        elif alg == "bidirectional":
+            self.search_alg_fnc = self.bidirectional_search
+        elif alg == "astar-table":
+            self.search_alg_fnc = lambda: self.a_star_search(storage="table")
+        elif alg == "astar-bloom":
+            self.search_alg_fnc = lambda: self.a_star_search(storage="bloom")
+        else:
+            raise ValueError(f"Unknown search algorithm: {alg}")
 
     def get_actions(self, state: tuple):
         """
@@ -68,11 +551,51 @@ class GameStateProblem(Problem):
             returns a set of actions
         """
         s, p = state
-        np_state = np.array(s)
-        self.sim.game_state.state = np_state
-        self.sim.game_state.decode_state = self.sim.game_state.make_state()
+        return legal_actions(s, p)
+
+    def get_predecessors(self, state: tuple):
+        """
+        Returns the list of (previous_state, action) pairs for which execute(previous_state, action)
+        gives state, so that planners can search backwards from the goal.
+
+        The player who moved last is the one not moving in state. Each of their blocks may have come
+        from a square a knight move away, kept only if the move is legal from there. Passes run
+        along the same channels both ways, so their ball may have come from any block the ball's
+        block can pass to, or from an empty square (a ball left behind by a block that moved) with
+        an open channel to one of those. Together this is the exact inverse of get_actions and
+        execute.
+        """
+        s, p = state
+        q = 1 - p
+        offset_idx = q * 6
+        ball_idx = offset_idx + 5
+        predecessors = []
+        # A block may have been holding the ball when it moved, so the ball's square is a candidate
+        free = ~BitboardRules.occupancy(s, ball_idx)
+        for k in range(5):
+            idx = offset_idx + k
+            pos = s[idx]
+            for prev_pos in iter_bits(KNIGHT_ATTACKS[pos] & free):
+                prev = s[:idx] + (prev_pos,) + s[idx + 1:]
+                if BitboardRules.single_piece_mask(prev, idx) & SQUARE_BITS[pos]:
+                    predecessors.append(((prev, q), (k, pos)))
 
-        return self.sim.generate_valid_actions(p)
+        pos = s[ball_idx]
+        blocks = BitboardRules.occupancy(s[offset_idx:ball_idx])
+        if not blocks & SQUARE_BITS[pos]:
+            return predecessors
+        opposing = BitboardRules.occupancy(s[p * 6:p * 6 + 5])
+        connected = BitboardRules.pass_closure(pos, blocks & ~SQUARE_BITS[pos], opposing)
+        sources = connected
+        empty = ~BitboardRules.occupancy(s)
+        for sq in iter_bits(connected | SQUARE_BITS[pos]):
+            row = sq * N_SQUARES
+            for prev_pos in iter_bits(QUEEN_LINES[sq] & empty & ~sources):
+                if not BETWEEN[row + prev_pos] & opposing:
+                    sources |= SQUARE_BITS[prev_pos]
+        for prev_pos in iter_bits(sources):
+            predecessors.append(((s[:ball_idx] + (prev_pos,) + s[ball_idx + 1:], q), (5, pos)))
+        return predecessors
 
     def execute(self, state: tuple, action: tuple):
         """
@@ -90,8 +613,9 @@ class GameStateProblem(Problem):
         """
         s, p = state
         k, v = action
-        offset_idx = p * 6
-        return tuple((tuple(s[i] if i != offset_idx + k else v for i in range(len(s))), (p + 1) % 2))
+        s = tuple(s)
+        idx = p * 6 + k
+        return s[:idx] + (v,) + s[idx + 1:], (p + 1) % 2
 
     #       Implement your search algorithm(s) here as methods of the GameStateProblem.
     #       You are free to specify parameters that your method may require.
@@ -109,68 +633,776 @@ class GameStateProblem(Problem):
     # NOTE: Remember to set self.search_alg_fnc in set_search_alg above.
     #
 
+    def a_star_search(self, heuristic=True, max_expansions=None, storage="dict", bloom_bits=1 << 24):
+        """
+        Returns a shortest list of (state, action) pairs from self.initial_state to a state in
+        self.goal_state_set, ending with (goal_state, None), or None if there is no such path (or
+        none was found within max_expansions expanded states).
+
+        With heuristic=False this is uniform cost search. planning_h never overestimates and drops
+        by at most one per move, so a state is final the first time it is expanded.
+
+        States are handled as PackedState keys, single ints, both in the frontier and in the
+        visited states. The frontier is a heap of (f, -g, count, key) entries, each packed into one
+        int. A state whose cost improves is pushed again and the older entry is skipped when it
+        comes off the heap. Paths are rebuilt from parent pointers once a goal is reached.
+
+        storage chooses where the cost and parent of every visited state are kept:
+            - "dict": a StateDict
+            - "table": a StateTable, several times smaller but slower to update
+            - "bloom": approximate. Expanded states go into a BloomFilter of bloom_bits bits, and
+              parent pointers live in the frontier entries, so only the paths still in use are kept.
+              A false positive skips a state that was never expanded, so the plan found may be
+              longer than the shortest one, or missed.
+        """
+        if storage == "bloom":
+            return self.a_star_bloom_search(heuristic, max_expansions, bloom_bits)
+        if storage not in ("dict", "table"):
+            raise ValueError(f"Unknown planner storage: {storage}")
+        start = PackedState.from_tuple(self.initial_state).key
+        goal_keys = {PackedState.from_tuple(goal).key for goal in self.goal_state_set}
+        h = self.planning_heuristic(heuristic)
+
+        visited = StateDict() if storage == "dict" else StateTable()
+        visited.put(start, 0, None, None)
+        frontier = [(h(start) << 16 | FRONTIER_G_MASK) << FRONTIER_G_SHIFT | start]
+        count = 1
+        expansions = 0
+        while frontier:
+            entry = heapq.heappop(frontier)
+            key = entry & KEY_MASK
+            g = FRONTIER_G_MASK - (entry >> FRONTIER_G_SHIFT & FRONTIER_G_MASK)
+            if g > visited.get(key)[0]:
+                continue
+            if key in goal_keys:
+                return self.reconstruct_path(key, visited)
+            if max_expansions is not None and expansions >= max_expansions:
+                return None
+            expansions += 1
+
+            state = PackedState(key)
+            # Sorted so that ties between equally good plans are broken the same way every run
+            for action in sorted(self.get_actions(state.to_tuple())):
+                child = state.execute(action).key
+                child_g = g + 1
+                entry = visited.get(child)
+                if entry is None or child_g < entry[0]:
+                    visited.put(child, child_g, key, action)
+                    f = child_g + h(child)
+                    heapq.heappush(frontier, ((f << 16 | FRONTIER_G_MASK - child_g) << FRONTIER_COUNT_BITS | count)
+                                   << KEY_BITS | child)
+                    count += 1
+        return None
+
+    def a_star_bloom_search(self, heuristic=True, max_expansions=None, bloom_bits=1 << 24):
+        """
+        The storage="bloom" variant of a_star_search. Frontier entries are (packed entry, node)
+        pairs, where the node (key, parent node, action) stands in for a visited state's parent
+        pointer. A node is freed as soon as no frontier entry leads back through it.
+        """
+        start = PackedState.from_tuple(self.initial_state).key
+        goal_keys = {PackedState.from_tuple(goal).key for goal in self.goal_state_set}
+        h = self.planning_heuristic(heuristic)
+
+        closed = BloomFilter(bloom_bits)
+        frontier = [((h(start) << 16 | FRONTIER_G_MASK) << FRONTIER_G_SHIFT | start, (start, None, None))]
+        count = 1
+        while frontier:
+            entry, node = heapq.heappop(frontier)
+            key = node[0]
+            g = FRONTIER_G_MASK - (entry >> FRONTIER_G_SHIFT & FRONTIER_G_MASK)
+            if key in closed:
+                continue
+            if key in goal_keys:
+                path = []
+                action = None
+                while node is not None:
+                    path.append((PackedState(node[0]).to_tuple(), action))
+                    node, action = node[1], node[2]
+                path.reverse()
+                return path
+            if max_expansions is not None and closed.count >= max_expansions:
+                return None
+            closed.add(key)
+
+            state = PackedState(key)
+            for action in sorted(self.get_actions(state.to_tuple())):
+                child = state.execute(action).key
+                if child not in closed:
+                    entry = ((g + 1 + h(child) << 16 | FRONTIER_G_MASK - g - 1) << FRONTIER_COUNT_BITS | count) \
+                        << KEY_BITS | child
+                    heapq.heappush(frontier, (entry, (child, node, action)))
+                    count += 1
+        return None
+
+    def planning_heuristic(self, heuristic=True):
+        """
+        Returns a function from PackedState keys to planning_h estimates towards the goal states,
+        or one that is always 0 if heuristic is False
+        """
+        if not heuristic:
+            return lambda key: 0
+        # Goal boards usually come from a BoardState, so their positions may be numpy integers
+        goal_states = {tuple(int(pos) for pos in s) for s, _ in self.goal_state_set}
+        return lambda key: planning_h(PackedState(key).to_tuple(), goal_states)
+
+    def bidirectional_search(self, max_expansions=None):
+        """
+        Same result as a_star_search: a shortest list of (state, action) pairs from
+        self.initial_state to a goal state, ending with (goal_state, None), or None.
+
+        One breadth-first search grows from the initial state, and another grows backwards (through
+        get_predecessors) from every state in self.goal_state_set. Each step expands a whole layer
+        of whichever side has the smaller frontier. The first layer that reaches a state seen by the
+        other side holds the shortest paths, and the best meeting state in it is used.
+
+        Both sides keep their states as PackedState keys in a StateDict: forward[key] holds the
+        depth, the previous state and the action taken from it, and backward[key] the depth, the
+        next state towards a goal and the action that leads there.
+        """
+        start = PackedState.from_tuple(self.initial_state).key
+        if self.is_goal(self.initial_state):
+            return [(self.initial_state, None)]
+
+        forward = StateDict()
+        forward.put(start, 0, None, None)
+        backward = StateDict()
+        for goal in sorted(self.goal_state_set):
+            backward.put(PackedState.from_tuple(goal).key, 0, None, None)
+        forward_layer = [start]
+        backward_layer = list(backward)
+        expansions = 0
+        while forward_layer and backward_layer:
+            if max_expansions is not None and expansions >= max_expansions:
+                return None
+            best = None
+            next_layer = []
+            if len(forward_layer) <= len(backward_layer):
+                expansions += len(forward_layer)
+                for key in forward_layer:
+                    state = PackedState(key)
+                    depth = forward[key][0] + 1
+                    for action in sorted(self.get_actions(state.to_tuple())):
+                        child = state.execute(action).key
+                        if child in forward:
+                            continue
+                        forward.put(child, depth, key, action)
+                        next_layer.append(child)
+                        if child in backward:
+                            length = depth + backward[child][0]
+                            if best is None or length < best[0]:
+                                best = (length, child)
+                forward_layer = next_layer
+            else:
+                expansions += len(backward_layer)
+                for key in backward_layer:
+                    depth = backward[key][0] + 1
+                    for prev, action in sorted(self.get_predecessors(PackedState(key).to_tuple())):
+                        prev = PackedState.from_tuple(prev).key
+                        if prev in backward:
+                            continue
+                        backward.put(prev, depth, key, action)
+                        next_layer.append(prev)
+                        if prev in forward:
+                            length = forward[prev][0] + depth
+                            if best is None or length < best[0]:
+                                best = (length, prev)
+                backward_layer = next_layer
+
+            if best is not None:
+                meet = best[1]
+                path = self.reconstruct_path(meet, forward)[:-1]
+                key = meet
+                while key is not None:
+                    _, next_key, action = backward[key]
+                    path.append((PackedState(key).to_tuple(), action))
+                    key = next_key
+                return path
+        return None
+
+    def reconstruct_path(self, key, visited):
+        """
+        Follows parent pointers in visited (a StateDict or StateTable) back from the PackedState key,
+        and returns the (state, action) list that leads to it
+        """
+        path = [(PackedState(key).to_tuple(), None)]
+        _, parent, action = visited.get(key)
+        while parent is not None:
+            path.append((PackedState(parent).to_tuple(), action))
+            _, parent, action = visited.get(parent)
+        path.reverse()
+        return path
+
     # From assignment 3:
     # You can add multiple adversarial search algorithms to the GameStateProblem class, and then
     # create various Player classes which use those specific algorithms.
 
 
-    def adversarial_search_method(self, state_tup, board_state, player_idx, plies):
-        plies = 3
-        possible_actions = self.get_actions(state_tup)
+    def adversarial_search_method(self, state_tup, board_state, player_idx, plies, time_budget=None):
+        """
+        Returns (action, value) for player_idx to play from state_tup.
+
+        With no time_budget, this is a fixed-depth search of `plies` plies. With a time_budget (in
+        seconds), it deepens one ply at a time until the budget runs out or `plies` is reached
+        (plies=None for no limit), and returns the result of the deepest search that completed.
+        Each iteration searches the root actions in the order the previous one ranked them.
+
+        With self.tactics, a pass that wins at once is played straight away with value WIN_SCORE,
+        and if the opponent threatens a winning pass, only the moves that take it away are
+        searched (see forced_replies).
+        """
+        if plies is None and time_budget is None:
+            raise ValueError("The adversarial search needs a depth, a time budget, or both")
+        counts = Counter() if self.stats_hook is not None else None
+        with count_movegen(counts):
+            maximumAction, maximum = self.search_position(state_tup, player_idx, plies, time_budget)
+        if self.stats_hook is not None:
+            self.stats.movegen = counts
+            self.stats_hook(self.stats)
+        return maximumAction, maximum
+
+    def search_position(self, state_tup, player_idx, plies, time_budget):
+        """
+        The search behind adversarial_search_method. Leaves its SearchStats in self.stats, and the
+        depth of the deepest completed search in self.completed_depth.
+        """
+        start = time.perf_counter()
+        self.completed_depth = 0
+        tt_probes, tt_hits = self.tt.probes, self.tt.hits
+        depth_times = []
+        root = PackedState.from_tuple(state_tup)
+        self.new_search()
+        # Ties go to the action generated first, exactly as in plain minimax, whatever order the
+        # actions are searched in
+        possible_actions = list(self.get_actions(state_tup))
+        wins = []
+        if self.tactics:
+            passes = winning_passes(root)
+            wins = [action for action in possible_actions if action in passes]
+            possible_actions = forced_replies(root, possible_actions)
+        ordered_actions = self.order_actions(root, possible_actions, 0)
+        search_root = self.search_root_parallel if self.workers else self.search_root
+
+        if wins:
+            maximumAction, maximum = wins[0], WIN_SCORE
+            root_values = {maximumAction: maximum}
+            depth_times.append((0, time.perf_counter() - start, 0))
+        elif time_budget is None:
+            maximumAction, maximum, root_values = search_root(root, possible_actions, ordered_actions, plies)
+            self.completed_depth = plies
+            depth_times.append((plies, time.perf_counter() - start, self.nodes))
+        else:
+            self.deadline = time.perf_counter() + time_budget
+            max_plies = MAX_PLIES if plies is None else plies
+            depth = 1
+            try:
+                while True:
+                    depth_start, depth_nodes = time.perf_counter(), self.nodes
+                    try:
+                        result = search_root(root, possible_actions, ordered_actions, depth)
+                    except SearchTimeout:
+                        break
+                    maximumAction, maximum, root_values = result
+                    self.completed_depth = depth
+                    depth_times.append((depth, time.perf_counter() - depth_start, self.nodes - depth_nodes))
+                    if depth >= max_plies:
+                        break
+                    # The previous best goes first, then the rest from highest to lowest (bound) value
+                    ordered_actions = sorted(possible_actions, key=lambda a: (a != maximumAction, -root_values[a]))
+                    depth += 1
+                    # The first iteration always completes, so there is a move to fall back on
+                    self.deadline_active = True
+            finally:
+                self.deadline = None
+                self.deadline_active = False
+
+        if self.verbose:
+            prev_actions_h = [(val, root.position(action[0] + (player_idx * 6)), action[1])
+                              for action, val in root_values.items()]
+            # reversed = True if player_idx == 0 else False
+            reversed = True
+            prev_actions = sorted(prev_actions_h, key=lambda x: x[0], reverse=reversed)
+            print()
+            print(prev_actions[:7])
+            print()
+
+        self.stats = SearchStats(self.nodes, self.leaves, self.expanded, self.children, self.cutoffs,
+                                 self.nodes_pruned, self.tt.probes - tt_probes, self.tt.hits - tt_hits,
+                                 depth_times, time.perf_counter() - start, tablebase_hits=self.tablebase_hits,
+                                 cache_hits=self.cache_hits)
+        return maximumAction, maximum
+
+    def ponder(self, state_tup, plies):
+        """
+        Thinks on the opponent's time. state_tup is the position after our move, with the opponent
+        to move. Its replies are taken in the order the search expects them, the transposition
+        table's best action first, and the position after each is searched from our side one ply
+        deeper at a time up to `plies`. The results stay in the transposition table, where the
+        search for the reply actually played finds them.
+
+        Runs until it is done, or until stop_pondering when started with start_pondering. Nothing
+        else may use this GameStateProblem until it has returned.
+
+        Does nothing with workers: the searches run in the worker processes then, and never see
+        this process's transposition table.
+        """
+        root = PackedState.from_tuple(state_tup)
+        if self.workers or root.is_termination_state():
+            return
+        self.new_search()
+        entry = self.tt.probe(zobrist_hash(root.state, root.player_idx) ^ ZOBRIST_MAXIMIZING)
+        replies = self.order_actions(root, list(self.get_actions(state_tup)), 0,
+                                     None if entry is None else entry[3])
+        try:
+            for reply in replies:
+                child = root.execute(reply)
+                if child.is_termination_state():
+                    continue
+                actions = list(self.get_actions(child.to_tuple()))
+                ordered_actions = self.order_actions(child, actions, 0)
+                for depth in range(1, plies + 1):
+                    self.search_root(child, actions, ordered_actions, depth)
+        except SearchTimeout:
+            pass
+
+    def start_pondering(self, state_tup, plies):
+        """
+        Runs ponder(state_tup, plies) in a background thread until stop_pondering is called
+        """
+        self.stop_pondering()
+        # Armed before the thread starts, so a stop can never come before it
+        self.deadline = float('inf')
+        self.deadline_active = True
+        self.ponder_thread = threading.Thread(target=self.ponder, args=(state_tup, plies), daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        """
+        Stops the background ponder, if one is running, at its next deadline check and waits for it
+        """
+        if self.ponder_thread is not None:
+            self.deadline = float('-inf')
+            self.ponder_thread.join()
+            self.ponder_thread = None
+            self.deadline = None
+            self.deadline_active = False
+
+    def search_root(self, root, possible_actions, ordered_actions, plies):
+        """
+        Searches every root action to `plies` plies, in the order given by ordered_actions.
+
+        Returns (best_action, best_value, root_values) where root_values maps each action to its
+        value, or an upper bound on it for actions that could not beat the best.
+        """
+        generated = {action: i for i, action in enumerate(possible_actions)}
         maximum = float('-inf')
         maximumAction = None
-        prev_actions_h = []
-        for action in possible_actions:
-            piece_to_move = state_tup[0][action[0] + (player_idx * 6)]
-            state_tuple = self.execute(state_tup, action)
-            board_state, next_player_idx = create_next_board(state_tuple)
-            val = self.determine_max(board_state, next_player_idx, 1, plies)
-            if val > maximum:
+        root_values = {}
+        board = SearchBoard(root.state, root.player_idx)
+        self.evaluator = IncrementalEvaluator(root.state)
+        for action in ordered_actions:
+            # Moves that cannot beat the current maximum come back as an upper bound only. A move
+            # that would win a tie is searched just below the maximum so a tie comes back exact.
+            wins_tie = maximumAction is not None and generated[action] < generated[maximumAction]
+            alpha = maximum - TIE_EPSILON if wins_tie else maximum
+            undo = board.make_move(action)
+            self.evaluator.make(*undo)
+            val = self.alpha_beta(board, 1, plies, alpha, float('inf'), True)
+            self.evaluator.unmake(*undo)
+            board.unmake_move(undo)
+            if val > maximum or (val == maximum and wins_tie):
                 maximum = val
                 maximumAction = action
+            root_values[action] = val
+        return maximumAction, maximum, root_values
 
-            prev_actions_h.append((val, piece_to_move,action[1]))
-        # reversed = True if player_idx == 0 else False
-        reversed = True
-        prev_actions = sorted(prev_actions_h, key=lambda x: x[0], reverse=reversed)
-        print()
-        print(prev_actions[:7])
-        print()
-        return maximumAction, maximum
+    def search_root_parallel(self, root, possible_actions, ordered_actions, plies):
+        """
+        Same as search_root, but every root action is searched by a worker process. Workers share
+        the best value found so far through self.shared_alpha and use it as their alpha bound.
 
+        The bound a worker starts from is lowered by TIE_EPSILON, so any action that ties or beats
+        the final maximum comes back with its exact value. Picking the first generated action among
+        those with the highest value then gives the same result as search_root.
+        """
+        if not ordered_actions:
+            return None, float('-inf'), {}
+        if self.executor is None:
+            self.shared_alpha = multiprocessing.Value('d', float('-inf'))
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_root_worker,
+                                                initargs=(self.shared_alpha, self.tt.size, self.tt.policy,
+                                                          self.tablebase, self.tt_cache))
+        self.shared_alpha.value = float('-inf')
+        time_left = self.deadline - time.perf_counter() if self.deadline_active else None
 
-    def determine_max(self, board_state, player_idx, current_plie, total_plies):
-        if self.minimax_term_conditions(board_state, current_plie, total_plies):
-            return calc_h(board_state, player_idx, True)
+        # The first action is searched on its own so the others start with a real bound to prune against
+        first = self.executor.submit(_search_root_action, root.key, ordered_actions[0], plies, time_left)
+        first.result()
+        futures = [first] + [self.executor.submit(_search_root_action, root.key, action, plies, time_left)
+                             for action in ordered_actions[1:]]
+        root_values = {}
+        for future in futures:
+            action, val, counters = future.result()
+            if val is None:
+                for remaining in futures:
+                    remaining.cancel()
+                raise SearchTimeout()
+            root_values[action] = val
+            self.add_counters(counters)
+
+        maximumAction = None
+        for action in possible_actions:
+            if maximumAction is None or root_values[action] > root_values[maximumAction]:
+                maximumAction = action
+        return maximumAction, root_values[maximumAction], root_values
+
+    def counters(self):
+        """
+        Returns the search counters as a tuple, in the order add_counters takes them
+        """
+        return (self.nodes, self.leaves, self.expanded, self.children, self.cutoffs, self.nodes_pruned,
+                self.tt.probes, self.tt.hits, self.tablebase_hits, self.cache_hits)
+
+    def add_counters(self, counters):
+        """
+        Adds the counters of a search done elsewhere, in the form returned by counters()
+        """
+        nodes, leaves, expanded, children, cutoffs, pruned, tt_probes, tt_hits, tablebase_hits, cache_hits = counters
+        self.nodes += nodes
+        self.leaves += leaves
+        self.expanded += expanded
+        self.children += children
+        self.cutoffs += cutoffs
+        self.nodes_pruned += pruned
+        self.tt.probes += tt_probes
+        self.tt.hits += tt_hits
+        self.tablebase_hits += tablebase_hits
+        self.cache_hits += cache_hits
+
+    def close(self):
+        """
+        Shuts down the worker processes used by search_root_parallel, if any were started
+        """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self.shared_alpha = None
+
+    def new_search(self):
+        """
+        Resets the per-search move ordering state. History scores are halved rather than cleared
+        so that what was learned on the previous move still counts, but less.
+        """
+        self.killers = {}
+        self.history = {k: v // 2 for k, v in self.history.items() if v > 1}
+        self.nodes_pruned = 0
+        self.nodes = 0
+        self.leaves = 0
+        self.expanded = 0
+        self.children = 0
+        self.cutoffs = 0
+        self.tablebase_hits = 0
+        self.cache_hits = 0
+        self.tt.new_search()
+
+    def alpha_beta(self, board, current_plie, total_plies, alpha, beta, is_max):
+        """
+        Alpha-beta version of determine_max (is_max=True) and determine_min (is_max=False). It
+        returns the same value as those whenever that value lies inside (alpha, beta); otherwise
+        it returns a bound on the far side of the window.
+
+        board is the SearchBoard for the node. Children are visited by making and unmaking moves on
+        it, so it is back in the same position when this returns.
+        """
+        self.nodes += 1
+        if self.deadline_active and not self.nodes & DEADLINE_CHECK_MASK and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        if self.tablebase is not None:
+            known = self.tablebase.probe(board.key)
+            if known is not None:
+                self.tablebase_hits += 1
+                return tablebase_value(*known, is_max)
+
+        player_idx = board.player_idx
+        if self.minimax_term_conditions(board, current_plie, total_plies):
+            self.leaves += 1
+            return self.evaluator.score(player_idx, is_max)
+
+        depth = total_plies - current_plie
+        tt_key = board.key ^ ZOBRIST_MAXIMIZING if is_max else board.key
+        tt_action = None
+        entry = self.tt.probe(tt_key)
+        if entry is None and self.tt_cache is not None:
+            entry = self.tt_cache.probe(tt_key)
+            if entry is not None:
+                self.cache_hits += 1
+                self.tt.store(tt_key, *entry)
+        if entry is not None:
+            tt_depth, flag, tt_value, tt_action = entry
+            if tt_depth >= depth:
+                if flag == TranspositionTable.EXACT \
+                        or (flag == TranspositionTable.LOWER and tt_value >= beta) \
+                        or (flag == TranspositionTable.UPPER and tt_value <= alpha):
+                    return tt_value
+
+        alpha_orig, beta_orig = alpha, beta
+        evaluator = self.evaluator
+        encoded = board.state
+        offset_idx = player_idx * 6
+        value = float('-inf') if is_max else float('inf')
+        best_action = None
+        if depth == 1:
+            # Every child is a leaf, and each one's score follows from this node's evaluator terms,
+            # unless the tablebase has a proven result for it
+            actions = board.generate_valid_actions()
+            self.nodes += len(actions)
+            self.expanded += 1
+            self.children += len(actions)
+            tablebase = self.tablebase
+            for action in actions:
+                idx = offset_idx + action[0]
+                old = encoded[idx]
+                known = None
+                if tablebase is not None:
+                    zobrist = ZOBRIST_KEYS[idx]
+                    known = tablebase.probe(board.key ^ zobrist[old] ^ zobrist[action[1]] ^ ZOBRIST_SIDE)
+                if known is not None:
+                    self.tablebase_hits += 1
+                    val = tablebase_value(*known, not is_max)
+                else:
+                    self.leaves += 1
+                    val = evaluator.score_after(idx, old, action[1], 1 - player_idx, not is_max)
+                if (val > value) if is_max else (val < value):
+                    value, best_action = val, action
+            if (is_max and value >= beta) or (not is_max and value <= alpha):
+                self.record_cutoff(player_idx, best_action, current_plie, depth)
+            actions = ()
+        else:
+            actions = self.order_actions(board, board.generate_valid_actions(), current_plie, tt_action)
+            self.expanded += 1
+            self.children += len(actions)
+        for i, action in enumerate(actions):
+            undo = board.make_move(action)
+            evaluator.make(*undo)
+            val = self.alpha_beta(board, current_plie + 1, total_plies, alpha, beta, not is_max)
+            evaluator.unmake(*undo)
+            board.unmake_move(undo)
+            if is_max:
+                if val > value:
+                    value, best_action = val, action
+                    alpha = max(alpha, value)
+            elif val < value:
+                value, best_action = val, action
+                beta = min(beta, value)
+
+            if alpha >= beta:
+                self.record_cutoff(player_idx, action, current_plie, depth)
+                self.nodes_pruned += len(actions) - i - 1
+                break
+
+        if value <= alpha_orig:
+            flag = TranspositionTable.UPPER
+        elif value >= beta_orig:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.tt.store(tt_key, depth, flag, value, best_action)
+        if self.tt_cache is not None:
+            self.tt_cache.store(tt_key, depth, flag, value, best_action)
+        return value
+
+    def order_actions(self, state, actions, current_plie, tt_action=None):
+        """
+        Sorts actions so the ones most likely to cause a cutoff are searched first: the best action
+        stored in the transposition table, then ball passes that move the ball toward the player's
+        goal row (furthest first), then this ply's killer moves, then everything else by history score.
+        """
+        player_idx = state.player_idx
+        ball_row = state.position(5 + player_idx * 6) // N_COLS
+        direction = 1 if player_idx == 0 else -1
+        killers = self.killers.get(current_plie, ())
+        history = self.history
+
+        def action_key(action):
+            if action == tt_action:
+                return -1, 0, action
+            if action[0] == 5:
+                advance = (action[1] // N_COLS - ball_row) * direction
+                if advance > 0:
+                    return 0, -advance, action
+            if action in killers:
+                return 1, 0, action
+            return 2, -history.get((player_idx, action), 0), action
+
+        return sorted(actions, key=action_key)
+
+    def record_cutoff(self, player_idx, action, current_plie, depth):
+        """
+        Remembers an action that caused a beta/alpha cutoff at this ply
+        """
+        self.cutoffs += 1
+        killers = self.killers.setdefault(current_plie, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        key = (player_idx, action)
+        self.history[key] = self.history.get(key, 0) + depth * depth
+
+    def determine_max(self, state, current_plie, total_plies):
+        """
+        state is a PackedState; its player_idx is the player moving at this node
+        """
+        if self.minimax_term_conditions(state, current_plie, total_plies):
+            return calc_h(state, state.player_idx, True)
 
         current_plie += 1
-        actions = self.get_actions((board_state.state, player_idx))
+        actions = BitboardRules.generate_valid_actions(state.state, state.player_idx)
         maximum = float('-inf')
         for action in actions:
-            new_state = self.execute((board_state.state, player_idx), action)
-            next_board_state, next_player_idx = create_next_board(new_state)
-            val = self.determine_min(next_board_state, next_player_idx, current_plie, total_plies)
+            val = self.determine_min(state.execute(action), current_plie, total_plies)
             if val > maximum:
                 maximum = val
         return maximum
 
-    def determine_min(self, board_state, player_idx, current_plie, total_plies):
-        if self.minimax_term_conditions(board_state, current_plie, total_plies):
-            return calc_h(board_state, player_idx, False)
+    def determine_min(self, state, current_plie, total_plies):
+        if self.minimax_term_conditions(state, current_plie, total_plies):
+            return calc_h(state, state.player_idx, False)
 
         current_plie += 1
-        actions = self.get_actions((board_state.state, player_idx))
+        actions = BitboardRules.generate_valid_actions(state.state, state.player_idx)
         minimum = float('inf')
         for action in actions:
-            new_state = self.execute((board_state.state, player_idx), action)
-            next_board_state, next_player_idx = create_next_board(new_state)
-            val = self.determine_max(next_board_state, next_player_idx, current_plie, total_plies)
+            val = self.determine_max(state.execute(action), current_plie, total_plies)
             if val < minimum:
                 minimum = val
         return minimum
 
-    def minimax_term_conditions(self, board_state, current_plie, total_plies):
-        return current_plie == total_plies or board_state.is_termination_state()
+    def minimax_term_conditions(self, state, current_plie, total_plies):
+        return current_plie == total_plies or state.is_termination_state()
+
+
+# Worker process state for GameStateProblem.search_root_parallel
+_worker_gsp = None
+_worker_alpha = None
+_worker_root = None
+
+
+def _init_root_worker(shared_alpha, tt_size, tt_policy, tablebase=None, tt_cache=None):
+    global _worker_gsp, _worker_alpha
+    b = BoardState()
+    _worker_gsp = GameStateProblem(b, b, 0, tt_size, tt_policy, tablebase=tablebase, tt_cache=tt_cache)
+    _worker_alpha = shared_alpha
+
+
+def _search_root_action(packed_root, action, plies, time_left):
+    """
+    Searches a single root action in a worker process. Returns (action, value, counters), where
+    counters holds the search counters for this action only (see GameStateProblem.counters), with
+    value None if time_left ran out first.
+    """
+    global _worker_root
+    gsp = _worker_gsp
+    if packed_root != _worker_root:
+        gsp.new_search()
+        _worker_root = packed_root
+    before = gsp.counters()
+
+    if time_left is not None:
+        gsp.deadline = time.perf_counter() + time_left
+        gsp.deadline_active = True
+    child = PackedState(packed_root).execute(action)
+    board = SearchBoard(child.state, child.player_idx)
+    gsp.evaluator = IncrementalEvaluator(board.state)
+    try:
+        val = gsp.alpha_beta(board, 1, plies, _worker_alpha.value - TIE_EPSILON, float('inf'), True)
+    except SearchTimeout:
+        return action, None, None
+    finally:
+        gsp.deadline = None
+        gsp.deadline_active = False
+
+    with _worker_alpha.get_lock():
+        if val > _worker_alpha.value:
+            _worker_alpha.value = val
+    return action, val, tuple(after - b for after, b in zip(gsp.counters(), before))
+
+
+def winning_passes(state):
+    """
+    Returns the list of passes that end the game at once in favour of the player to move in state,
+    a PackedState: those that put the ball on a block on the goal row
+    """
+    player_idx = state.player_idx
+    mask = BitboardRules.single_ball_mask(state.state, player_idx) & GOAL_ROW_MASKS[player_idx]
+    return [(5, target) for target in iter_bits(mask) if state.execute((5, target)).is_termination_state()]
+
+
+def forced_replies(state, actions):
+    """
+    If the opponent of the player to move in state, a PackedState, could win with a pass right now,
+    returns the actions that leave it no winning pass. Otherwise, or if no action stops every
+    winning pass, returns actions unchanged. The order of actions is kept.
+    """
+    opponent = PackedState.from_tuple((state.state, 1 - state.player_idx))
+    if not winning_passes(opponent):
+        return actions
+    replies = [action for action in actions if not winning_passes(state.execute(action))]
+    return replies or actions
+
+
+def tablebase_value(wins, distance, is_max):
+    """
+    Converts a tablebase result (whether the player to move wins, and in how many plies) into a
+    search value. Values are from the root player's side, and the root player is the one to move
+    at min nodes, so the root player wins when wins != is_max. Quicker wins and slower losses are
+    worth more.
+    """
+    if wins != is_max:
+        return WIN_SCORE - distance
+    return distance - WIN_SCORE
+
+
+def child_states(state, actions):
+    """
+    Returns an (N, 12) array holding the encoded state reached by each of the N actions from state
+    """
+    actions = np.array(actions).reshape(-1, 2)
+    states = np.tile(np.array(state.state), (len(actions), 1))
+    states[np.arange(len(actions)), actions[:, 0] + state.player_idx * 6] = actions[:, 1]
+    return states
+
+
+def team_moves_needed(encoded_state, goal_state, offset_idx):
+    """
+    Lower bound on the moves one team needs to bring its pieces (offset_idx to offset_idx + 5) to
+    their places in goal_state: each block needs its knight distance, and a misplaced ball needs
+    one move, since any number of passes fit in one move
+    """
+    moves = 0
+    for idx in range(offset_idx, offset_idx + 5):
+        moves += KNIGHT_DISTANCE[encoded_state[idx] * N_SQUARES + goal_state[idx]]
+    return moves + (encoded_state[offset_idx + 5] != goal_state[offset_idx + 5])
+
+
+def planning_h(state, goal_states):
+    """
+    Admissible estimate of the plies needed to go from state, an (encoded_state, player_idx) tuple,
+    to any of goal_states (encoded states; the goal may be reached with either player to move).
+
+    The player to move needs `mover` moves and the other player `other`. The mover plays plies
+    1, 3, 5, ... and the other player plies 2, 4, ..., so at least max(2 * mover - 1, 2 * other)
+    plies are needed.
+    """
+    encoded_state, player_idx = state
+    best = None
+    for goal_state in goal_states:
+        mover = team_moves_needed(encoded_state, goal_state, player_idx * 6)
+        other = team_moves_needed(encoded_state, goal_state, (1 - player_idx) * 6)
+        plies = max(2 * mover - 1, 2 * other, 0)
+        if best is None or plies < best:
+            best = plies
+    return best
 
 
     # This should return a value in the range of [-7 to 7] depending on
@@ -223,11 +1455,18 @@ def calc_h(board_state, player_idx, is_max):
     # else:
     #     return round(white_ball_row - (7 - black_ball_row))
 
-def create_next_board(state_and_plx):
-    state, plx = state_and_plx
-    b = BoardState()
-    b.state = np.array(state)
-    b.decode_state = b.make_state()
-    # next_plx = 0 if plx == 1 else 0
-    next_plx = plx
-    return b, next_plx
+
+def calc_h_batch(states, player_idx, is_max):
+    """
+    Vectorized calc_h: scores every row of an (N, 12) array of encoded states, all for the same
+    player_idx and is_max, and returns an array of N values equal to calling calc_h on each row.
+    """
+    rows = np.asarray(states) // 7
+    if player_idx == 1:
+        white_blocks = rows[:, :5]
+        score = white_blocks.sum(axis=1) / 5 + 7 * (white_blocks == 7).sum(axis=1) + 20 * (rows[:, 5] == 7)
+    else:
+        black_blocks = rows[:, 6:11]
+        score = 7 - black_blocks.sum(axis=1) / 5 + 7 * (black_blocks == 0).sum(axis=1) + 20 * (rows[:, 11] == 0)
+    score = np.round(score, 3)
+    return score if is_max else -score
@@ -0,0 +1,202 @@
+"""
+Endgame tablebase: proven wins and losses for positions close to the end of a game, found by
+retrograde analysis and stored in a sorted file that the search memory maps and probes.
+
+    python tablebase.py endgame.tb --plies 4
+    python tablebase.py endgame.tb --plies 3 --seed 49,37,46,41,55,41,50,51,52,53,54,52:0
+
+The full game is far too large to enumerate, so the analysis covers a region: every position
+reachable from a set of seed positions within `plies` plies. Positions where the game is over
+(is_termination_state) are lost for the player to move, since the player who moved last wins.
+From those, results are propagated backwards through GameStateProblem.get_predecessors: a position
+is won if some move leads to a lost position, and lost if every move leads to a won one. Only
+positions whose moves were all generated (those less than `plies` plies from a seed) can be proven
+lost, so every entry is exact, and the distance is the length of the forced line found inside the
+region.
+
+File layout: a header (magic, entry count, plies) followed by one 10 byte record per position,
+sorted by key: the 64 bit Zobrist key (see game.zobrist_hash) big-endian, so that records sort as
+bytes, then 1 if the player to move wins (0 if they lose), then the distance in plies.
+"""
+import argparse
+import mmap
+import struct
+from collections import deque
+
+from game import BoardState, PackedState, legal_actions, zobrist_hash
+from search import GameStateProblem
+
+MAGIC = b"GMTB"
+HEADER = struct.Struct("<4sII")
+RECORD = struct.Struct(">QBB")
+
+# Positions from the end of the test games: white to move with winning passes available, and a
+# race where both balls are close to their goal rows
+DEFAULT_SEEDS = [
+    ((49, 37, 46, 41, 55, 41, 50, 51, 52, 53, 54, 52), 0),
+    ((44, 37, 46, 41, 40, 41, 1, 2, 52, 4, 5, 52), 0),
+    ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 1),
+]
+
+
+def analyse(seeds, plies):
+    """
+    Runs the retrograde analysis over the positions within `plies` plies of seeds, a list of
+    (encoded_state, player_idx) tuples. Returns (positions, results), where positions is the number
+    of positions in the region and results maps the PackedState key of every solved position to
+    (wins, distance) for the player to move.
+    """
+    b = BoardState()
+    gsp = GameStateProblem(b, b, 0, verbose=False)
+
+    depth = {}
+    layer = []
+    for seed in seeds:
+        key = PackedState.from_tuple(seed).key
+        if key not in depth:
+            depth[key] = 0
+            layer.append(key)
+
+    # unresolved[key] counts the moves from an expanded position not yet known to lead to a win
+    unresolved = {}
+    results = {}
+    solved = deque()
+    for d in range(plies + 1):
+        next_layer = []
+        for key in layer:
+            state = PackedState(key)
+            if state.is_termination_state():
+                results[key] = (False, 0)
+                solved.append(key)
+                continue
+            if d == plies:
+                continue
+            actions = legal_actions(state.state, state.player_idx)
+            unresolved[key] = len(actions)
+            for action in actions:
+                child = state.execute(action).key
+                if child not in depth:
+                    depth[child] = d + 1
+                    next_layer.append(child)
+        layer = next_layer
+
+    # Positions come off the queue in order of distance, so wins get their shortest line and
+    # losses their longest
+    while solved:
+        key = solved.popleft()
+        wins, distance = results[key]
+        for prev, _ in gsp.get_predecessors(PackedState(key).to_tuple()):
+            prev = PackedState.from_tuple(prev).key
+            if prev in results or prev not in unresolved:
+                continue
+            if not wins:
+                results[prev] = (True, distance + 1)
+                solved.append(prev)
+            else:
+                unresolved[prev] -= 1
+                if unresolved[prev] == 0:
+                    results[prev] = (False, distance + 1)
+                    solved.append(prev)
+    return len(depth), results
+
+
+def write_tablebase(path, results, plies):
+    """
+    Writes results, as returned by analyse, to path in the tablebase file format
+    """
+    records = sorted((zobrist_hash(*PackedState(key).to_tuple()), wins, distance)
+                     for key, (wins, distance) in results.items())
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records), plies))
+        for zobrist_key, wins, distance in records:
+            f.write(RECORD.pack(zobrist_key, int(wins), min(distance, 255)))
+
+
+def build_tablebase(path, seeds=DEFAULT_SEEDS, plies=4):
+    """
+    Analyses the region around seeds and writes it to path. Returns (positions, wins, losses).
+    """
+    positions, results = analyse(seeds, plies)
+    write_tablebase(path, results, plies)
+    wins = sum(1 for won, _ in results.values() if won)
+    return positions, wins, len(results) - wins
+
+
+class Tablebase:
+    """
+    A tablebase file, memory mapped read-only so that every process probing it shares the same
+    pages. Pickling a Tablebase only keeps its path, and unpickling opens the file again, so it can
+    be handed to worker processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.plies = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a tablebase file")
+
+    def probe(self, key):
+        """
+        Returns (wins, distance) for the position with Zobrist key `key`: whether the player to
+        move wins, and in how many plies. Returns None if the position was not solved.
+        """
+        target = key.to_bytes(8, "big")
+        mm = self.mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            offset = HEADER.size + mid * RECORD.size
+            found = mm[offset:offset + 8]
+            if found < target:
+                lo = mid + 1
+            elif found > target:
+                hi = mid
+            else:
+                return mm[offset + 8] == 1, mm[offset + 9]
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+
+def parse_seed(text):
+    """
+    Parses a seed given as 12 comma separated positions, a colon and the player to move
+    """
+    positions, player_idx = text.split(":")
+    return tuple(int(pos) for pos in positions.split(",")), int(player_idx)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an endgame tablebase by retrograde analysis")
+    parser.add_argument("path")
+    parser.add_argument("--plies", type=int, default=4, help="size of the analysed region around the seeds")
+    parser.add_argument("--seed", action="append", type=parse_seed,
+                        help="seed position as p0,...,p11:player_idx (repeatable; defaults to DEFAULT_SEEDS)")
+    args = parser.parse_args()
+
+    positions, wins, losses = build_tablebase(args.path, args.seed or DEFAULT_SEEDS, args.plies)
+    print(f"Analysed {positions} positions: {wins} won and {losses} lost for the player to move")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+import threading
+import time
+from collections import Counter
+
 import numpy as np
 import pytest
 
-from game import BoardState, GameSimulator, AdversarialSearchPlayer
-from search import GameStateProblem, calc_h
+import search
+from game import BoardState, GameSimulator, AdversarialSearchPlayer, PackedState, legal_actions
+from game import MOVEGEN_COUNTS, count_movegen
+from search import WIN_SCORE, GameStateProblem, IncrementalEvaluator, TranspositionTable, calc_h, calc_h_batch
+from search import forced_replies, winning_passes
 
 
 @pytest.mark.parametrize("p1_class,p2_class,encoded_state_tuple,exp_winner,exp_stat", [
@@ -75,3 +82,269 @@ def test_h(p1_class, p2_class, encoded_state_tuple, exp_winner, h):
     assert (calc_h(b1, 0) == h)
 
 
+
+@pytest.mark.parametrize("encoded_state_tuple,player_idx", [
+    ((1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52), 0),
+    ((49, 37, 46, 41, 55, 41, 50, 51, 52, 53, 54, 52), 0),
+    ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 1),
+])
+def test_alpha_beta_matches_minimax(encoded_state_tuple, player_idx):
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0)
+    state_tup = (encoded_state_tuple, player_idx)
+    root = PackedState.from_tuple(state_tup)
+
+    best_action, best_val = None, float('-inf')
+    for action in gsp.get_actions(state_tup):
+        val = gsp.determine_max(root.execute(action), 1, 3)
+        if val > best_val:
+            best_action, best_val = action, val
+
+    assert gsp.adversarial_search_method(state_tup, None, player_idx, 3) == (best_action, best_val)
+
+    # At 3 plies every cutoff falls on depth 1 nodes, whose leaves are scored without being visited
+    gsp.adversarial_search_method(state_tup, None, player_idx, 4)
+    assert gsp.nodes_pruned > 0
+
+
+@pytest.mark.parametrize("policy", ["depth", "lru"])
+def test_transposition_table_is_bounded(policy):
+    tt = TranspositionTable(size=8, policy=policy)
+    for key in range(100):
+        tt.store(key, 1, TranspositionTable.EXACT, float(key), (0, key))
+    assert len(tt) <= 8
+    assert tt.probe(99) == (1, TranspositionTable.EXACT, 99.0, (0, 99))
+
+
+def test_transposition_table_prefers_depth():
+    tt = TranspositionTable(size=8, policy="depth")
+    tt.store(1, 3, TranspositionTable.EXACT, 1.0, None)
+    tt.store(9, 1, TranspositionTable.EXACT, 2.0, None)  # Same slot, shallower: kept out
+    assert tt.probe(1) is not None and tt.probe(9) is None
+
+    tt.new_search()
+    tt.store(9, 1, TranspositionTable.EXACT, 2.0, None)  # Entries from an older search are replaced
+    assert tt.probe(1) is None and tt.probe(9) is not None
+
+
+def test_transposition_table_reused_between_moves():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0)
+    state_tup = ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 1)
+    first = gsp.adversarial_search_method(state_tup, None, 1, 3)
+    hits = gsp.tt.hits
+    assert gsp.adversarial_search_method(state_tup, None, 1, 3) == first
+    assert gsp.tt.hits > hits
+
+
+def test_iterative_deepening_matches_fixed_depth():
+    b1 = BoardState()
+    state_tup = ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 1)
+    fixed = GameStateProblem(b1, b1, 0).adversarial_search_method(state_tup, None, 1, 3)
+    gsp = GameStateProblem(b1, b1, 0)
+    assert gsp.adversarial_search_method(state_tup, None, 1, 3, time_budget=60) == fixed
+    assert gsp.completed_depth == 3
+
+
+def test_iterative_deepening_honours_deadline():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0)
+    start = time.perf_counter()
+    action, value = gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, None, time_budget=0.2)
+    assert time.perf_counter() - start < 0.5
+    assert action in gsp.get_actions((tuple(b1.state), 0))
+    assert gsp.completed_depth >= 1
+
+
+@pytest.mark.parametrize("encoded_state_tuple,player_idx", [
+    ((1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52), 0),
+    ((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 1),
+])
+def test_parallel_root_search_matches_serial(encoded_state_tuple, player_idx):
+    b1 = BoardState()
+    state_tup = (encoded_state_tuple, player_idx)
+    serial = GameStateProblem(b1, b1, 0).adversarial_search_method(state_tup, None, player_idx, 3)
+    gsp = GameStateProblem(b1, b1, 0, workers=2)
+    try:
+        assert gsp.adversarial_search_method(state_tup, None, player_idx, 3) == serial
+    finally:
+        gsp.close()
+
+
+def test_parallel_root_search_without_actions():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, workers=2)
+    root = PackedState.from_tuple((tuple(b1.state), 0))
+    assert gsp.search_root_parallel(root, [], [], 2) == gsp.search_root(root, [], [], 2)
+    assert gsp.executor is None
+
+
+def test_root_workers_use_parent_tt_settings():
+    search._init_root_worker(None, 1 << 10, "lru")
+    assert (search._worker_gsp.tt.size, search._worker_gsp.tt.policy) == (1 << 10, "lru")
+
+
+def test_search_stats_hook():
+    b1 = BoardState()
+    reported = []
+    gsp = GameStateProblem(b1, b1, 0, verbose=False, stats_hook=reported.append)
+    gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, 3)
+    stats, = reported
+    assert stats is gsp.stats
+    assert stats.nodes == gsp.nodes and stats.nodes > stats.leaves > 0
+    assert stats.expanded > 0 and stats.branching_factor > 1
+    assert stats.cutoffs > 0 and stats.tt_probes >= stats.tt_hits
+    assert [depth for depth, _, _ in stats.depth_times] == [3]
+    # One move generation per expanded node, plus the root actions
+    assert stats.movegen == {"search_board": stats.expanded, "legal_actions": 1}
+
+    gsp.stats_hook = None
+    gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, 3, time_budget=10)
+    assert [depth for depth, _, _ in gsp.stats.depth_times] == [1, 2, 3]
+    assert gsp.completed_depth == 3
+    gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, 2)
+    assert gsp.completed_depth == 2
+    with pytest.raises(ValueError):
+        gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, None)
+    assert sum(nodes for _, _, nodes in gsp.stats.depth_times) == gsp.stats.nodes
+    assert gsp.stats.movegen is None and len(reported) == 1
+
+
+def test_immediate_win_skips_search():
+    state = ((49, 37, 46, 41, 55, 41, 50, 51, 52, 53, 54, 52), 0)
+    assert winning_passes(PackedState.from_tuple(state)) == [(5, 49), (5, 55)]
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, verbose=False, tactics=True)
+    action, value = gsp.adversarial_search_method(state, None, 0, 3)
+    assert action in [(5, 49), (5, 55)] and value == WIN_SCORE
+    assert gsp.stats.nodes == 0
+
+
+def test_forced_replies():
+    # Black threatens to pass from 17 to 1 through 9. Only the block on 24 can cover 9; moving the
+    # block under white's ball leaves a position where black's pass no longer ends the game.
+    state = PackedState.from_tuple(((28, 29, 30, 31, 24, 30, 1, 46, 17, 50, 54, 17), 0))
+    actions = sorted(legal_actions(state.state, 0))
+    replies = forced_replies(state, actions)
+    assert (4, 9) in replies
+    assert all(action == (4, 9) or action[0] == 2 for action in replies)
+    assert len(replies) < len(actions)
+    # Without a threat every action is kept
+    start = PackedState.from_tuple(((1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52), 0))
+    start_actions = sorted(legal_actions(start.state, 0))
+    assert forced_replies(start, start_actions) == start_actions
+
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, verbose=False, tactics=True)
+    action, _ = gsp.adversarial_search_method(state.to_tuple(), None, 0, 3)
+    assert action in replies
+    full = GameStateProblem(b1, b1, 0, verbose=False)
+    full.adversarial_search_method(state.to_tuple(), None, 0, 3)
+    assert gsp.stats.nodes < full.stats.nodes
+
+
+def test_ponder_reuses_search():
+    b1 = BoardState()
+    start = (1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52)
+    player = AdversarialSearchPlayer(GameStateProblem(b1, b1, 0, verbose=False), 0, 3, ponder=True)
+    action, _ = player.policy([b1.decode_single_pos(pos) for pos in start])
+    # With a fixed depth the background search ends once every reply has been searched
+    player.gsp.ponder_thread.join()
+
+    after = PackedState.from_tuple((start, 0)).execute(action)
+    state_tup = after.execute(sorted(legal_actions(after.state, 1))[0]).to_tuple()
+    fresh = GameStateProblem(b1, b1, 0, verbose=False)
+    expected = fresh.adversarial_search_method(state_tup, None, 0, 3)
+    player.stop_pondering()
+    assert player.gsp.adversarial_search_method(state_tup, None, 0, 3) == expected
+    assert player.gsp.stats.nodes * 10 < fresh.stats.nodes
+
+
+def test_ponder_without_actions():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, verbose=False)
+    player = AdversarialSearchPlayer(gsp, 0, 3, ponder=True)
+    # What the search returns for a root without legal actions
+    player.policy_fnc = lambda *args: (None, float('-inf'))
+    assert player.policy(b1.make_state()) == (None, float('-inf'))
+    assert gsp.ponder_thread is None
+
+
+def test_ponder_refuses_workers():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, verbose=False, workers=2)
+    with pytest.raises(ValueError):
+        AdversarialSearchPlayer(gsp, 0, 3, ponder=True)
+    # Called directly, ponder leaves the worker pool alone
+    gsp.ponder((tuple(b1.state), 1), 2)
+    assert gsp.executor is None and gsp.nodes == 0
+
+
+def test_stop_pondering():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0, verbose=False)
+    player = AdversarialSearchPlayer(gsp, 0, None, time_budget=0.05, ponder=True)
+    player.policy(b1.make_state())
+    thread = gsp.ponder_thread
+    assert thread.is_alive()
+    time.sleep(0.05)
+    player.stop_pondering()
+    assert not thread.is_alive() and gsp.ponder_thread is None
+    assert gsp.deadline is None and not gsp.deadline_active
+    assert gsp.adversarial_search_method((tuple(b1.state), 0), None, 0, 2)[0] is not None
+
+
+def test_count_movegen_is_per_context():
+    state = (1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52)
+    with count_movegen(Counter()) as counts:
+        legal_actions(state, 0)
+        # Another thread has its own context, so its calls are not counted here
+        thread = threading.Thread(target=legal_actions, args=(state, 1))
+        thread.start()
+        thread.join()
+        with count_movegen(None):
+            legal_actions(state, 1)
+        legal_actions(state, 1)
+    assert counts == {"legal_actions": 2}
+
+    with pytest.raises(RuntimeError):
+        with count_movegen(Counter()):
+            raise RuntimeError()
+    assert MOVEGEN_COUNTS.get() is None
+
+
+@pytest.mark.parametrize("player_idx", [0, 1])
+@pytest.mark.parametrize("is_max", [True, False])
+def test_calc_h_batch_matches_calc_h(player_idx, is_max):
+    states = np.array([
+        (1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52),
+        (49, 37, 46, 41, 40, 37, 1, 2, 3, 4, 5, 3),
+        (49, 37, 46, 41, 40, 49, 1, 2, 52, 4, 5, 52),
+        (14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55),
+        (49, 50, 51, 52, 53, 53, 0, 1, 2, 3, 4, 0),
+    ])
+    scores = calc_h_batch(states, player_idx, is_max)
+    for state, score in zip(states, scores):
+        assert calc_h(PackedState.from_state(state, player_idx), player_idx, is_max) == score
+
+
+def test_incremental_evaluator_tracks_calc_h():
+    b1 = BoardState()
+    gsp = GameStateProblem(b1, b1, 0)
+    state = PackedState.from_state((14, 21, 22, 28, 29, 22, 11, 20, 34, 48, 55, 55), 0)
+    evaluator = IncrementalEvaluator(state.state)
+    for _ in range(20):
+        # Always take the action that moves the furthest, so rows change and blocks reach the goal rows
+        action = max(sorted(gsp.get_actions(state.to_tuple())), key=lambda a: a[1] if state.player_idx == 0 else -a[1])
+        idx = state.player_idx * 6 + action[0]
+        for player_idx in (0, 1):
+            expected = calc_h(state.execute(action), player_idx, False)
+            assert evaluator.score_after(idx, state.position(idx), action[1], player_idx, False) == expected
+        evaluator.make(idx, state.position(idx), action[1])
+        evaluator.unmake(idx, state.position(idx), action[1])
+        assert evaluator.score(0, True) == calc_h(state, 0, True)
+
+        evaluator.make(idx, state.position(idx), action[1])
+        state = state.execute(action)
+        for player_idx in (0, 1):
+            assert evaluator.score(player_idx, True) == calc_h(state, player_idx, True)
@@ -0,0 +1,71 @@
+from functools import partial
+
+import pytest
+
+from game import PackedState, legal_actions
+from mcts import MCTS, MCTSPlayer, _init_mcts_worker, _search_worker_tree, best_action, root_statistics
+from tournament import mcts_player, random_player, run_tournament
+
+START_STATE = ((1, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52), 0)
+
+
+@pytest.mark.parametrize("rollout", ["random", "heuristic"])
+def test_mcts_finds_winning_pass(rollout):
+    state = PackedState.from_tuple(((49, 37, 46, 41, 55, 41, 50, 51, 52, 53, 54, 52), 0))
+    engine = MCTS(rollout=rollout, seed=0)
+    root = engine.search(state.key, iterations=300)
+    action, win_rate = best_action(root_statistics(root))
+    assert state.execute(action).is_termination_state()
+    assert win_rate == 1.0
+    assert root.visits == 300 and engine.iterations == 300
+
+
+def test_mcts_is_reproducible_and_reuses_tree():
+    key = PackedState.from_tuple(START_STATE).key
+    first = root_statistics(MCTS(seed=5).search(key, iterations=200))
+    engine = MCTS(seed=5)
+    assert root_statistics(engine.search(key, iterations=200)) == first
+    assert set(first) == legal_actions(*START_STATE)
+
+    action, _ = best_action(first)
+    child = max(engine.root.children, key=lambda node: node.visits)
+    reply = child.children[0]
+    visits = reply.visits
+    root = engine.search(reply.key, iterations=50)
+    assert root is reply and root.parent is None
+    assert root.visits == visits + 50
+
+
+def test_mcts_budgets():
+    engine = MCTS(seed=0)
+    with pytest.raises(ValueError):
+        engine.search(PackedState.from_tuple(START_STATE).key)
+    root = engine.search(PackedState.from_tuple(START_STATE).key, time_budget=0.05)
+    assert root.visits == engine.iterations > 0
+    with pytest.raises(ValueError):
+        MCTS(rollout="greedy")
+
+
+def test_mcts_player_parallel():
+    player = MCTSPlayer(0, iterations=50, workers=2, seed=1)
+    try:
+        action, win_rate = player.search(PackedState.from_tuple(START_STATE).key)
+    finally:
+        player.close()
+    assert action in legal_actions(*START_STATE)
+    assert 0.0 <= win_rate <= 1.0
+
+
+def test_worker_tasks_report_their_own_visits():
+    # The pool may run every task for a move on the same worker, which then keeps growing one tree
+    _init_mcts_worker({})
+    key = PackedState.from_tuple(START_STATE).key
+    workers, iterations = 4, 20
+    results = [_search_worker_tree(key, iterations, None, (0, 1, i)) for i in range(workers)]
+    assert [sum(visits for visits, _ in result.values()) for result in results] == [iterations] * workers
+
+
+def test_mcts_beats_random():
+    summary = run_tournament(partial(mcts_player, iterations=200, rollout="heuristic"), random_player, 2,
+                             workers=0, seed=0, max_rounds=100)
+    assert summary.wins["A"] == 2
@@ -0,0 +1,10 @@
+import pytest
+
+from perft import PERFT_POSITIONS, run_perft
+
+
+@pytest.mark.parametrize("name,state,known", PERFT_POSITIONS, ids=[p[0] for p in PERFT_POSITIONS])
+def test_perft(name, state, known):
+    # Depth 4 takes a few seconds per position; run `python perft.py --depth 4` to check it
+    for depth, positions, _ in run_perft(state, 3):
+        assert positions == known[depth]
@@ -0,0 +1,43 @@
+import asyncio
+import io
+
+from game import AsyncGameSimulator, GameSimulator, RandomPlayer, run_games
+from remote import EngineProcess, RemotePlayer, engine_command, serve
+from tournament import random_player
+
+
+class AsyncRandomPlayer(RandomPlayer):
+    async def policy(self, decode_state):
+        await asyncio.sleep(0)
+        return super().policy(decode_state)
+
+
+def test_async_simulator_matches_run():
+    expected = [GameSimulator([RandomPlayer(0, seed), RandomPlayer(1, seed + 1)]).run(verbose=False, max_rounds=80)
+                for seed in range(20)]
+    sims = [AsyncGameSimulator([AsyncRandomPlayer(0, seed), RandomPlayer(1, seed + 1)]) for seed in range(20)]
+    assert run_games(sims, max_rounds=80) == expected
+
+
+def test_serve():
+    requests = io.StringIO("7 1 2 3 4 5 3 50 51 52 53 54 52 0\n\n8 1 2 3 4 5 3 50 51 52 53 54 52 1\n")
+    replies = io.StringIO()
+    serve(random_player, 0, requests, replies)
+    first, second = replies.getvalue().splitlines()
+    assert first.startswith("7 ") and first.endswith(" None")
+    assert second.startswith("8 ")
+
+
+def test_remote_players_share_engine():
+    async def play():
+        engine = EngineProcess(engine_command(plies=0, seed=3))
+        try:
+            sims = [AsyncGameSimulator([RemotePlayer(0, engine), RemotePlayer(1, engine)]) for _ in range(8)]
+            return await asyncio.gather(*(sim.run(verbose=False, max_rounds=30) for sim in sims)), engine.next_id
+        finally:
+            await engine.close()
+
+    results, requests = asyncio.run(play())
+    assert len(results) == 8
+    assert all(status in ("No issues", "Round limit reached") for _, _, status in results)
+    assert requests == sum(rounds + 1 for rounds, _, _ in results)
@@ -1,8 +1,39 @@
 import numpy as np
 import queue
+import random
 import pytest
-from game import BoardState, GameSimulator, Rules
-from search import GameStateProblem
+from concurrent.futures import ThreadPoolExecutor
+from game import BoardState, BitboardRules, GameSimulator, PackedState, Rules, BETWEEN, N_SQUARES, QUEEN_LINES, SQUARE_BITS
+from game import SearchBoard, legal_actions, zobrist_hash
+from search import BloomFilter, GameStateProblem, StateDict, StateTable, planning_h
+
+
+def reference_ball_moves(state, player):
+    """
+    Squares the ball can reach with any number of passes, found by walking the eight queen rays
+    square by square from every block reached so far. A ray stops at an opposing block; the
+    player's own blocks along it can all be passed to. Independent of the game module's tables.
+    """
+    offset = player * 6
+    ball = state[offset + 5]
+    team = {state[offset + i] for i in range(5)} - {ball}
+    opposing = {state[(1 - player) * 6 + i] for i in range(5)}
+    reached = set()
+    frontier = [ball]
+    while frontier:
+        sq = frontier.pop()
+        for d_col, d_row in [(1,0),(-1,0),(0,1),(0,-1),(1,1),(1,-1),(-1,1),(-1,-1)]:
+            col, row = sq % 7 + d_col, sq // 7 + d_row
+            while 0 <= col < 7 and 0 <= row < 8:
+                pos = row * 7 + col
+                if pos in opposing:
+                    break
+                if pos in team and pos not in reached:
+                    reached.add(pos)
+                    frontier.append(pos)
+                col, row = col + d_col, row + d_row
+    return reached
+
 
 class TestSearch:
 
@@ -18,7 +49,7 @@ class TestSearch:
     # NOTE: If you'd like to test multiple variants of your algorithms, enter their keys below
     # in the parametrize function. Your set_search_alg should then set the correct method to
     # use.
-    @pytest.mark.parametrize("alg", ["", ""])
+    @pytest.mark.parametrize("alg", ["", "ucs", "bidirectional", "astar-table", "astar-bloom"])
     def test_game_state_problem(self, alg):
         """
         Tests search based planning
@@ -53,6 +84,84 @@ class TestSearch:
         assert sln[2][1] == (0, 23)
         assert sln[4] == (tuple((tuple(b2.state), 0)), None)
 
+    @pytest.mark.parametrize("target,plies", [((0, 23), 4), ((2, 8), 1), ((5, 1), 1), ((11, 51), 3)])
+    def test_a_star_matches_uniform_cost(self, target, plies):
+        """
+        A* and bidirectional search must find plans as short as uniform cost search, and planning_h
+        must never overestimate
+        """
+        b1 = BoardState()
+        b2 = BoardState()
+        b2.update(*target)
+        astar = GameStateProblem(b1, b2, 0)
+        ucs = GameStateProblem(b1, b2, 0)
+        ucs.set_search_alg("ucs")
+        bidirectional = GameStateProblem(b1, b2, 0)
+        bidirectional.set_search_alg("bidirectional")
+        sln = astar.search_alg_fnc()
+        assert len(sln) - 1 == len(ucs.search_alg_fnc()) - 1 == len(bidirectional.search_alg_fnc()) - 1 == plies
+        assert astar.is_goal(sln[-1][0])
+        for i, (state, action) in enumerate(sln):
+            assert planning_h(state, [tuple(b2.state)]) <= plies - i
+            if action is not None:
+                assert sln[i + 1][0] == astar.execute(state, action)
+
+    @pytest.mark.parametrize("convert", [tuple, list, np.array])
+    def test_execute_accepts_any_sequence(self, convert):
+        b1 = BoardState()
+        gsp = GameStateProblem(b1, b1, 0)
+        state = (convert([1,2,3,4,5,3,50,51,52,53,54,52]), 1)
+        assert gsp.execute(state, (2, 45)) == ((1,2,3,4,5,3,50,51,45,53,54,52), 0)
+
+    def test_predecessors_invert_execute(self):
+        """
+        get_predecessors must return exactly the (state, action) pairs that execute maps to a state
+        """
+        b1 = BoardState()
+        gsp = GameStateProblem(b1, b1, 0)
+        rng = np.random.default_rng(0)
+        state = (tuple(b1.state), 0)
+        for _ in range(60):
+            actions = sorted(gsp.get_actions(state))
+            for action in actions:
+                child = gsp.execute(state, action)
+                predecessors = gsp.get_predecessors(child)
+                assert (state, action) in predecessors
+                for prev, prev_action in predecessors:
+                    assert prev_action in gsp.get_actions(prev)
+                    assert gsp.execute(prev, prev_action) == child
+            state = gsp.execute(state, actions[rng.integers(len(actions))])
+
+    def test_state_table_matches_dict(self):
+        rng = np.random.default_rng(0)
+        keys = [int(k) | int(rng.integers(1 << 9)) << 64 for k in rng.integers(0, 1 << 63, 5000, dtype=np.int64)]
+        table = StateTable(capacity=8)
+        reference = StateDict()
+        parent = None
+        for i, key in enumerate(keys):
+            action = None if parent is None else (i % 6, i % N_SQUARES)
+            table.put(key, i % 100, parent, action)
+            reference.put(key, i % 100, parent, action)
+            parent = key
+        # Replacing entries keeps them in place
+        for key in keys[::7]:
+            table.put(key, 1, keys[0], (5, 55))
+            reference.put(key, 1, keys[0], (5, 55))
+        assert len(table) == len(reference)
+        for key in keys:
+            assert table.get(key) == reference[key]
+            assert key in table
+        assert table.get(keys[0] ^ 1) is None
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1 << 16, 4)
+        keys = [PackedState.from_state(state, 0).key for state in
+                [(i, 2, 3, 4, 5, 3, 50, 51, 52, 53, 54, 52) for i in range(56)]]
+        for key in keys[:28]:
+            bloom.add(key)
+        assert all(key in bloom for key in keys[:28])
+        assert not any(key in bloom for key in keys[28:])
+
     def test_initial_state(self):
         """
         Confirms the initial state of the game board
@@ -73,6 +182,82 @@ class TestSearch:
         generated_actions = sim.generate_valid_actions(1)
         assert (7,0) not in generated_actions
 
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_move_lists_follow_updates(self, seed):
+        rng = random.Random(seed)
+        sim = GameSimulator(None)
+        for current_round in range(120):
+            player = current_round % 2
+            for p in (0, 1):
+                assert sim.generate_valid_actions(p) == legal_actions(sim.game_state.state, p)
+            if sim.game_state.is_termination_state():
+                break
+            sim.update(rng.choice(sorted(sim.generate_valid_actions(player))), player)
+        assert sim.move_lists.matches(sim.game_state.state)
+
+        # Changing the board behind the simulator's back rebuilds the lists
+        sim.game_state.state = np.array([14,21,22,28,29,22,11,20,34,48,55,55])
+        assert sim.generate_valid_actions(1) == legal_actions(sim.game_state.state, 1)
+
+    @pytest.mark.parametrize("state,player", [
+        ([1,2,3,4,5,3,50,51,52,53,54,52], 0),
+        ([1,2,3,4,5,3,50,51,52,53,54,52], 1),
+        ([14,21,22,28,29,22,11,20,34,48,55,55], 0),
+        ([14,21,22,28,29,22,11,20,34,48,55,55], 1),
+        ([49,37,46,41,40,37,1,2,3,4,5,3], 0),
+        ([1,2,3,4,24,3,50,51,17,53,54,52], 0),
+        ([1,2,3,4,31,3,16,17,52,53,54,52], 0),
+        ([1,2,3,4,31,3,16,17,52,53,54,52], 1),
+    ])
+    def test_bitboard_actions(self, state, player):
+        board = BoardState()
+        board.state = np.array(state)
+        board.decode_state = board.make_state()
+
+        offset_idx = player * 6
+        ref = set()
+        for i in range(5):
+            col_0, row_0 = board.decode_state[offset_idx + i]
+            occupied = [cr for j, cr in enumerate(board.decode_state) if j != offset_idx + i]
+            for col_move, row_move in [(1,2),(-1,2),(-2,1),(2,1),(2,-1),(-2,-1),(-1,-2),(1,-2)]:
+                col, row = col_0 + col_move, row_0 + row_move
+                if 0 <= col < 7 and 0 <= row < 8 and (col, row) not in occupied:
+                    ref.add((i, board.encode_single_pos((col, row))))
+        for pos in reference_ball_moves(state, player):
+            ref.add((5, pos))
+
+        assert BitboardRules.generate_valid_actions(tuple(state), player) == ref
+
+    def test_get_actions_concurrently(self):
+        board = BoardState()
+        gsp = GameStateProblem(board, board, 0)
+        states = [(tuple(board.state), 0), (tuple(board.state), 1),
+                  ((14,21,22,28,29,22,11,20,34,48,55,55), 0), ((14,21,22,28,29,22,11,20,34,48,55,55), 1),
+                  ((49,37,46,41,40,37,1,2,3,4,5,3), 0), ((1,2,3,4,24,3,50,51,17,53,54,52), 0)] * 50
+        expected = [legal_actions(s, p) for s, p in states]
+        with ThreadPoolExecutor(8) as executor:
+            assert list(executor.map(gsp.get_actions, states)) == expected
+        # Nothing on the problem was written to
+        assert gsp.initial_state == (tuple(board.state), 0)
+
+    @pytest.mark.parametrize("a,b,between", [
+        ((0,0), (3,3), [(1,1),(2,2)]),
+        ((3,3), (0,0), [(1,1),(2,2)]),
+        ((1,0), (1,7), [(1,r) for r in range(1,7)]),
+        ((6,2), (2,2), [(3,2),(4,2),(5,2)]),
+        ((2,5), (5,2), [(3,4),(4,3)]),
+        ((1,1), (2,2), []),
+    ])
+    def test_between_table(self, a, b, between):
+        board = BoardState()
+        sq_a, sq_b = board.encode_single_pos(a), board.encode_single_pos(b)
+        assert QUEEN_LINES[sq_a] & SQUARE_BITS[sq_b]
+        assert BETWEEN[sq_a * N_SQUARES + sq_b] == sum(SQUARE_BITS[board.encode_single_pos(cr)] for cr in between)
+
+    def test_not_aligned(self):
+        board = BoardState()
+        assert not QUEEN_LINES[board.encode_single_pos((0,0))] & SQUARE_BITS[board.encode_single_pos((1,2))]
+
     ## NOTE: You are highly encouraged to add failing test cases here
     ## in order to test your validate_action implementation. To add an
     ## invalid action, fill in the action tuple, the player_idx, the
@@ -89,6 +274,15 @@ class TestSearch:
         ((5,2), 0, True, ""),
         ((5,4), 0, True, ""),
         ((5,5), 0, True, ""),
+        ((0,15), 0, False, "not a knight move"),
+        ((1,2), 0, False, "not a knight move"),
+        ((5,3), 0, False, "already at 3"),
+        ((5,10), 0, False, "no block of its own team"),
+        ((5,50), 0, False, "no block of its own team"),
+        ((6,14), 0, False, "not a piece"),
+        ((0,56), 0, False, "not on the board"),
+        ((0,), 0, False, "not a (relative_idx, position) pair"),
+        ((0,14), 2, False, "not 0 or 1"),
     ])
     def test_validate_action(self, action, player, is_valid, val_msg):
         sim = GameSimulator(None)
@@ -98,6 +292,37 @@ class TestSearch:
             with pytest.raises(ValueError) as exinfo:
                 result = sim.validate_action(action, player)
             assert val_msg in str(exinfo.value)
+
+    @pytest.mark.parametrize("state,action,val_msg", [
+        ([1,2,3,4,31,3,16,17,52,53,54,52], (0,16), "the square is occupied"),
+        ([1,2,3,4,31,3,16,17,52,53,54,52], (5,31), "blocked by the opponent"),
+    ])
+    def test_validate_action_in_position(self, state, action, val_msg):
+        sim = GameSimulator(None)
+        sim.game_state.state = np.array(state)
+        sim.game_state.decode_state = sim.game_state.make_state()
+        with pytest.raises(ValueError, match=val_msg):
+            sim.validate_action(action, 0)
+
+    @pytest.mark.parametrize("state", [
+        [1,2,3,4,5,3,50,51,52,53,54,52],
+        [14,21,22,28,29,22,11,20,34,48,55,55],
+        [49,37,46,41,40,37,1,2,3,4,5,3],
+        [1,2,3,4,31,3,16,17,52,53,54,52],
+        [44,37,46,41,40,37,8,15,52,11,5,15],
+    ])
+    def test_validate_action_matches_generated(self, state):
+        sim = GameSimulator(None)
+        sim.game_state.state = np.array(state)
+        sim.game_state.decode_state = sim.game_state.make_state()
+        for player in (0, 1):
+            valid_actions = sim.generate_valid_actions(player)
+            for action in [(i, pos) for i in range(6) for pos in range(N_SQUARES)]:
+                try:
+                    valid = sim.validate_action(action, player)
+                except ValueError:
+                    valid = False
+                assert valid == (action in valid_actions)
         
 
     @pytest.mark.parametrize("state,is_term", [
@@ -115,6 +340,68 @@ class TestSearch:
 
         assert board.is_termination_state() == is_term
 
+    @pytest.mark.parametrize("state,is_term", [
+        ([1,2,3,4,5,3,50,51,52,53,54,52], False),
+        ([1,2,3,4,5,55,50,51,52,53,54,0], False),
+        ([1,2,3,4,49,49,50,51,52,53,54,0], False),
+        ([1,2,3,4,49,49,50,51,52,53,54,54], True),
+        ([1,2,3,4,5,5,50,51,52,53,6,6], True),
+        ([1,2,3,4,5,5,50,4,52,53,6,6], False),
+        ([1,2,3,4,5,3,50,51,56,53,54,52], False),
+    ])
+    def test_packed_termination_state(self, state, is_term):
+        packed = PackedState.from_state(state, 0)
+        assert packed.is_termination_state() == is_term
+
+    def test_packed_state(self):
+        board = BoardState()
+        packed = PackedState.from_state(board.state, 1)
+        assert packed.state == tuple(board.state)
+        assert packed.decode_state == board.decode_state
+        assert packed.player_idx == 1
+        assert packed.to_tuple() == (tuple(board.state), 1)
+        assert packed == PackedState.from_tuple((tuple(board.state), 1))
+        assert packed != PackedState.from_state(board.state, 0)
+        assert len({packed, PackedState(packed.key)}) == 1
+
+        gsp = GameStateProblem(board, board, 0)
+        for action in gsp.get_actions(packed.to_tuple()):
+            assert packed.execute(action).to_tuple() == gsp.execute(packed.to_tuple(), action)
+
+        with pytest.raises(ValueError):
+            PackedState.from_state([-1,2,3,4,5,3,50,51,52,53,54,52], 0)
+
+    def test_zobrist_incremental(self):
+        board = BoardState()
+        search_board = SearchBoard(board.state, 0)
+        key = zobrist_hash(board.state, 0)
+        assert search_board.key == key
+        assert key != zobrist_hash(board.state, 1)
+        for action in search_board.generate_valid_actions():
+            undo = search_board.make_move(action)
+            assert search_board.key == zobrist_hash(search_board.state, 1)
+            search_board.unmake_move(undo)
+            assert search_board.key == key
+
+    def test_search_board_make_unmake(self):
+        board = BoardState()
+        board.state = np.array([14,21,22,28,29,22,11,20,34,48,55,55])
+        board.decode_state = board.make_state()
+        search_board = SearchBoard(board.state, 1)
+        packed = PackedState.from_state(board.state, 1)
+        actions = search_board.generate_valid_actions()
+        assert set(actions) == BitboardRules.generate_valid_actions(board.state, 1)
+        for action in actions:
+            undo = search_board.make_move(action)
+            child = packed.execute(action)
+            assert search_board.to_packed() == child
+            assert search_board.decode_state == child.decode_state
+            assert search_board.is_termination_state() == child.is_termination_state()
+            assert set(search_board.generate_valid_actions()) == BitboardRules.generate_valid_actions(child.state, 0)
+            search_board.unmake_move(undo)
+            assert search_board.to_packed() == packed
+            assert search_board.decode_state == board.decode_state
+
     def test_encoded_decode(self):
         board = BoardState()
         assert board.decode_state  == [board.decode_single_pos(x) for x in board.state]
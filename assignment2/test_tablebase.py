@@ -0,0 +1,64 @@
+import pickle
+
+from game import BoardState, PackedState, SearchBoard, legal_actions, zobrist_hash
+from search import WIN_SCORE, GameStateProblem, IncrementalEvaluator
+from tablebase import DEFAULT_SEEDS, Tablebase, build_tablebase
+
+
+def test_tablebase_probe(tmp_path):
+    path = tmp_path / "endgame.tb"
+    positions, wins, losses = build_tablebase(path, DEFAULT_SEEDS[:1], plies=2)
+    assert positions > wins + losses > 0
+
+    seed = DEFAULT_SEEDS[0]
+    state = PackedState.from_tuple(seed)
+    with Tablebase(path) as tb:
+        assert len(tb) == wins + losses
+        assert tb.probe(zobrist_hash(*seed)) == (True, 1)
+        finished = [state.execute(action) for action in legal_actions(state.state, state.player_idx)
+                    if state.execute(action).is_termination_state()]
+        assert finished
+        for child in finished:
+            assert tb.probe(zobrist_hash(*child.to_tuple())) == (False, 0)
+
+        copy = pickle.loads(pickle.dumps(tb))
+        assert copy.probe(zobrist_hash(*seed)) == (True, 1)
+        copy.close()
+
+
+def test_search_uses_tablebase(tmp_path):
+    path = tmp_path / "endgame.tb"
+    build_tablebase(path, DEFAULT_SEEDS[:1], plies=2)
+    seed = DEFAULT_SEEDS[0]
+    b1 = BoardState()
+    with Tablebase(path) as tb:
+        gsp = GameStateProblem(b1, b1, 0, verbose=False, tablebase=tb)
+        action, value = gsp.adversarial_search_method(seed, None, 0, 3)
+    assert value == WIN_SCORE
+    assert PackedState.from_tuple(seed).execute(action).is_termination_state()
+    assert gsp.stats.tablebase_hits > 0
+
+
+def test_search_probes_tablebase_at_leaves(tmp_path):
+    path = tmp_path / "endgame.tb"
+    build_tablebase(path, DEFAULT_SEEDS[:1], plies=2)
+    seed = DEFAULT_SEEDS[0]
+    # Black's block on 50 came from 35, so seed is one of this position's children
+    parent = PackedState.from_tuple(((49, 37, 46, 41, 55, 41, 35, 51, 52, 53, 54, 52), 1))
+    b1 = BoardState()
+    with Tablebase(path) as tb:
+        assert tb.probe(zobrist_hash(*seed)) is not None
+        gsp = GameStateProblem(b1, b1, 0, verbose=False, tablebase=tb)
+        gsp.evaluator = IncrementalEvaluator(parent.state)
+        # Every child of parent is a leaf at this depth, scored without a call per child
+        value = gsp.alpha_beta(SearchBoard(parent.state, 1), 1, 2, float('-inf'), float('inf'), False)
+        assert gsp.tablebase_hits > 0
+
+        expected = float('inf')
+        for action in legal_actions(parent.state, 1):
+            child = parent.execute(action)
+            gsp.evaluator = IncrementalEvaluator(child.state)
+            expected = min(expected, gsp.alpha_beta(SearchBoard(child.state, 0), 2, 2,
+                                                    float('-inf'), float('inf'), True))
+    assert value == expected
+    assert value == WIN_SCORE - 1 or value == 1 - WIN_SCORE
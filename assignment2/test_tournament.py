@@ -0,0 +1,46 @@
+from functools import partial
+
+from game import GameSimulator, RandomPlayer
+from tournament import DEFAULT_OPENING_PLIES, adversarial_player, play_game, random_player, run_tournament
+
+
+def test_run_respects_round_limit(capsys):
+    sim = GameSimulator([RandomPlayer(0, 1), RandomPlayer(1, 2)])
+    rounds, winner, status = sim.run(verbose=False, max_rounds=10)
+    assert (rounds, winner, status) == (9, "DRAW", "Round limit reached")
+    assert [player_idx for player_idx, _ in sim.move_times] == [0, 1] * 5
+    assert capsys.readouterr().out == ""
+
+
+def test_play_game_is_reproducible():
+    first = play_game(0, 7, random_player, random_player, max_rounds=50)
+    second = play_game(0, 7, random_player, random_player, max_rounds=50)
+    assert first[:5] == second[:5]
+
+
+def test_play_game_closes_players():
+    closed = []
+
+    class ClosingPlayer(RandomPlayer):
+        def close(self):
+            closed.append(self.player_idx)
+
+    play_game(0, 7, ClosingPlayer, ClosingPlayer, max_rounds=20)
+    assert closed == [0, 1]
+
+
+def test_tournament_summary(capsys):
+    results = []
+    summary = run_tournament(partial(adversarial_player, plies=2), random_player, 4, workers=2, seed=3,
+                             max_rounds=40, on_result=lambda summary, result: results.append(result[0]))
+    assert sorted(results) == [0, 1, 2, 3]
+    assert summary.games == 4
+    assert summary.wins["A"] + summary.wins["B"] + summary.draws == 4
+    assert len(summary.lengths) == 4
+    assert sum(len(times) for times in summary.move_times.values()) == sum(summary.lengths) - 4 * DEFAULT_OPENING_PLIES
+    assert capsys.readouterr().out == ""
+
+    serial = run_tournament(partial(adversarial_player, plies=2), random_player, 4, workers=0, seed=3,
+                            max_rounds=40)
+    assert (serial.wins, serial.draws, sorted(serial.lengths)) == \
+        (summary.wins, summary.draws, sorted(summary.lengths))
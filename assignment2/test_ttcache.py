@@ -0,0 +1,59 @@
+import pickle
+
+import pytest
+
+from game import BoardState
+from search import GameStateProblem, TranspositionTable
+from ttcache import HEADER, SLOT, TTCache
+
+
+def test_ttcache_store_and_probe(tmp_path):
+    path = tmp_path / "search.ttc"
+    with TTCache(path, size=64) as cache:
+        assert cache.probe(5) is None
+        cache.store(5, 3, TranspositionTable.EXACT, 1.5, (2, 17))
+        cache.store(7, 1, TranspositionTable.UPPER, -2.25, None)
+        assert cache.probe(5) == (3, TranspositionTable.EXACT, 1.5, (2, 17))
+        assert cache.probe(7) == (1, TranspositionTable.UPPER, -2.25, None)
+        # 69 shares a slot with 5: a shallower entry does not replace it, a deeper one does
+        assert cache.probe(69) is None
+        cache.store(69, 2, TranspositionTable.LOWER, 0.5, (0, 1))
+        assert cache.probe(5) is not None and cache.probe(69) is None
+        cache.store(69, 4, TranspositionTable.LOWER, 0.5, (0, 1))
+        assert cache.probe(5) is None and cache.probe(69) == (4, TranspositionTable.LOWER, 0.5, (0, 1))
+        assert len(cache) == 2
+
+        # A slot with a payload that does not match its check word reads as a miss
+        offset = HEADER.size + 7 * SLOT.size
+        cache.mm[offset + 8] ^= 1
+        assert cache.probe(7) is None
+
+        copy = pickle.loads(pickle.dumps(cache))
+        assert copy.size == 64 and copy.probe(69) == (4, TranspositionTable.LOWER, 0.5, (0, 1))
+        copy.close()
+
+    with TTCache(path, size=1024) as cache:
+        assert cache.size == 64
+
+    path.write_bytes(b"not a cache")
+    with pytest.raises(ValueError):
+        TTCache(path)
+
+
+def test_search_warm_starts_from_cache(tmp_path):
+    b1 = BoardState()
+    state = (tuple(b1.state), 0)
+    cold = GameStateProblem(b1, b1, 0, verbose=False)
+    expected = cold.adversarial_search_method(state, None, 0, 3)
+
+    path = tmp_path / "search.ttc"
+    first = GameStateProblem(b1, b1, 0, verbose=False, tt_cache=TTCache(path))
+    assert first.adversarial_search_method(state, None, 0, 3) == expected
+    assert first.stats.cache_hits == 0
+    first.tt_cache.close()
+
+    second = GameStateProblem(b1, b1, 0, verbose=False, tt_cache=TTCache(path))
+    assert second.adversarial_search_method(state, None, 0, 3) == expected
+    assert second.stats.cache_hits > 0
+    assert second.stats.nodes < first.stats.nodes
+    second.tt_cache.close()
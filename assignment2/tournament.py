@@ -0,0 +1,226 @@
+"""
+Headless tournament runner: plays many games between two engines across a process pool and
+collects the results into a single TournamentSummary.
+
+    python tournament.py --games 200 --workers 8 --plies-a 2 --plies-b 3
+"""
+import argparse
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+from game import AdversarialSearchPlayer, BoardState, GameSimulator, RandomPlayer, Rules
+from mcts import MCTSPlayer
+from search import GameStateProblem
+from ttcache import TTCache
+
+DEFAULT_MAX_ROUNDS = 200
+DEFAULT_OPENING_PLIES = 4
+
+
+def adversarial_player(player_idx, seed, plies=3, time_budget=None, **gsp_kwargs):
+    """
+    Player factory for an AdversarialSearchPlayer with printing turned off. Bind the search
+    settings with functools.partial, e.g. partial(adversarial_player, plies=2).
+    """
+    b = BoardState()
+    gsp = GameStateProblem(b, b, player_idx, verbose=False, **gsp_kwargs)
+    return AdversarialSearchPlayer(gsp, player_idx, plies, time_budget)
+
+
+def mcts_player(player_idx, seed, iterations=1000, time_budget=None, **mcts_kwargs):
+    """
+    Player factory for an MCTSPlayer seeded from the game seed. Bind the search settings with
+    functools.partial, e.g. partial(mcts_player, iterations=500, rollout="heuristic").
+    """
+    return MCTSPlayer(player_idx, iterations, time_budget, seed=seed, **mcts_kwargs)
+
+
+def random_player(player_idx, seed):
+    """
+    Player factory for a RandomPlayer seeded from the game seed
+    """
+    return RandomPlayer(player_idx, seed)
+
+
+def play_opening(sim, seed, plies):
+    """
+    Plays `plies` random block moves on the simulator, so that games between deterministic engines
+    start from different positions. Blocks holding the ball are never moved, which keeps the
+    opening from ending the game or separating a ball from its block.
+    """
+    rng = random.Random(seed)
+    state = sim.game_state
+    for _ in range(plies):
+        sim.current_round += 1
+        player_idx = sim.current_round % 2
+        offset = player_idx * 6
+        actions = sorted((rel_idx, pos)
+                         for rel_idx in range(5)
+                         if state.state[offset + rel_idx] != state.state[offset + 5]
+                         for pos in Rules.single_piece_actions(state, offset + rel_idx))
+        if not actions:
+            sim.current_round -= 1
+            break
+        sim.update(rng.choice(actions), player_idx)
+
+
+def play_game(game_idx, seed, white_factory, black_factory, opening_plies=DEFAULT_OPENING_PLIES,
+              max_rounds=DEFAULT_MAX_ROUNDS):
+    """
+    Plays one headless game. Each factory is called as factory(player_idx, seed) and must return a
+    Player; factories have to be picklable (module level functions or partials of them) to be sent
+    to a worker process. Both players are closed once the game is over.
+
+    Returns (game_idx, seed, rounds, winner, status, move_times), where winner is "WHITE", "BLACK"
+    or "DRAW" and move_times is the simulator's list of (player_idx, seconds) pairs.
+    """
+    players = [white_factory(0, seed), black_factory(1, seed)]
+    try:
+        sim = GameSimulator(players)
+        play_opening(sim, seed, opening_plies)
+        rounds, winner, status = sim.run(verbose=False, max_rounds=max_rounds)
+    finally:
+        for player in players:
+            player.close()
+    return game_idx, seed, rounds, winner, status, sim.move_times
+
+
+class TournamentSummary:
+    """
+    Running totals for a tournament between two engines, named in `names`. Results are added one
+    game at a time, so a summary can be printed while the tournament is still going.
+    """
+
+    def __init__(self, names=("A", "B")):
+        self.names = tuple(names)
+        self.wins = {name: 0 for name in self.names}
+        self.draws = 0
+        self.games = 0
+        self.lengths = []
+        self.move_times = {name: [] for name in self.names}
+        self.statuses = {}
+
+    def add(self, result, white, black):
+        """
+        Adds a play_game result where engine `white` had the white pieces and `black` the black ones
+        """
+        _, _, rounds, winner, status, move_times = result
+        self.games += 1
+        self.lengths.append(rounds + 1)
+        if winner == "WHITE":
+            self.wins[white] += 1
+        elif winner == "BLACK":
+            self.wins[black] += 1
+        else:
+            self.draws += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        colours = (white, black)
+        for player_idx, seconds in move_times:
+            self.move_times[colours[player_idx]].append(seconds)
+
+    def score(self, name):
+        """
+        Tournament score of an engine: a point per win and half a point per draw
+        """
+        return self.wins[name] + 0.5 * self.draws
+
+    def report(self):
+        lines = [f"Games: {self.games}  Draws: {self.draws}"]
+        for name in self.names:
+            lines.append(f"{name}: wins {self.wins[name]}  score {self.score(name):.1f}/{self.games}")
+        if self.lengths:
+            lengths = np.array(self.lengths)
+            lines.append(f"Game length: mean {lengths.mean():.1f}  min {lengths.min()}  max {lengths.max()}")
+        for name in self.names:
+            times = np.array(self.move_times[name])
+            if len(times):
+                lines.append(f"{name} move time: mean {times.mean() * 1000:.1f}ms  "
+                             f"p50 {np.percentile(times, 50) * 1000:.1f}ms  "
+                             f"p95 {np.percentile(times, 95) * 1000:.1f}ms  max {times.max() * 1000:.1f}ms")
+        for status, count in sorted(self.statuses.items()):
+            lines.append(f"{status}: {count}")
+        return "\n".join(lines)
+
+
+def run_tournament(factory_a, factory_b, games, workers=None, seed=0, names=("A", "B"), swap_colours=True,
+                   opening_plies=DEFAULT_OPENING_PLIES, max_rounds=DEFAULT_MAX_ROUNDS, on_result=None):
+    """
+    Plays `games` games between two engines over a pool of `workers` processes (the default is one
+    per CPU; workers=0 plays every game in this process) and returns a TournamentSummary.
+
+    Game i is seeded with seed + i. With swap_colours the engines alternate colours from game to
+    game, otherwise engine A always plays white. on_result(summary, result) is called as each game
+    finishes, in completion order.
+    """
+    summary = TournamentSummary(names)
+    schedule = []
+    for game_idx in range(games):
+        if swap_colours and game_idx % 2:
+            schedule.append((names[1], names[0], factory_b, factory_a))
+        else:
+            schedule.append((names[0], names[1], factory_a, factory_b))
+
+    def record(result):
+        white, black = schedule[result[0]][:2]
+        summary.add(result, white, black)
+        if on_result is not None:
+            on_result(summary, result)
+
+    if workers == 0:
+        for game_idx, (_, _, white_factory, black_factory) in enumerate(schedule):
+            record(play_game(game_idx, seed + game_idx, white_factory, black_factory, opening_plies, max_rounds))
+        return summary
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_game, game_idx, seed + game_idx, white_factory, black_factory,
+                                   opening_plies, max_rounds)
+                   for game_idx, (_, _, white_factory, black_factory) in enumerate(schedule)]
+        for future in as_completed(futures):
+            record(future.result())
+    return summary
+
+
+def engine_factory(plies, tt_cache=None, tactics=False):
+    """
+    Factory for the command line: plies > 0 is an adversarial search to that depth, 0 a random player.
+    Adversarial players read and write tt_cache, a TTCache, if one is given, and check the root for
+    immediate wins and threats with tactics.
+    """
+    if plies > 0:
+        return partial(adversarial_player, plies=plies, tt_cache=tt_cache, tactics=tactics)
+    return random_player
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a headless tournament between two engines")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--plies-a", type=int, default=2, help="search depth of engine A (0 plays randomly)")
+    parser.add_argument("--plies-b", type=int, default=2, help="search depth of engine B (0 plays randomly)")
+    parser.add_argument("--opening-plies", type=int, default=DEFAULT_OPENING_PLIES)
+    parser.add_argument("--max-rounds", type=int, default=DEFAULT_MAX_ROUNDS)
+    parser.add_argument("--no-swap", action="store_true", help="engine A always plays white")
+    parser.add_argument("--tt-cache", help="persistent transposition cache file shared by every game")
+    parser.add_argument("--tactics", action="store_true", help="check for immediate wins and threats before searching")
+    parser.add_argument("--progress", type=int, default=10, help="print a summary every N games (0 for none)")
+    args = parser.parse_args()
+
+    def progress(summary, result):
+        if args.progress and summary.games % args.progress == 0 and summary.games < args.games:
+            print(summary.report())
+            print()
+
+    tt_cache = TTCache(args.tt_cache) if args.tt_cache else None
+    engines = [engine_factory(plies, tt_cache, args.tactics) for plies in (args.plies_a, args.plies_b)]
+    summary = run_tournament(engines[0], engines[1], args.games,
+                             workers=args.workers, seed=args.seed, swap_colours=not args.no_swap,
+                             opening_plies=args.opening_plies, max_rounds=args.max_rounds, on_result=progress)
+    print(summary.report())
+
+
+if __name__ == "__main__":
+    main()
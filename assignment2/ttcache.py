@@ -0,0 +1,110 @@
+"""
+Persistent transposition cache: searched positions kept in a memory mapped file, so that later
+runs and sibling worker processes start from what earlier searches found.
+
+    gsp = GameStateProblem(b, b, 0, tt_cache=TTCache("search.ttc"))
+
+The file is a header (magic, slot count) followed by fixed size slots, one per Zobrist key modulo
+the slot count, each holding the same (depth, flag, value, best_action) entry as a
+TranspositionTable. A slot is replaced by an entry searched at least as deep as the one it holds.
+
+Every process maps the file shared and reads and writes it without locking. Each slot stores its
+key XORed with its payload rather than the key itself, so a slot torn by two processes writing at
+once no longer matches any key and reads as a miss instead of a wrong entry.
+"""
+import mmap
+import os
+import struct
+
+MAGIC = b"GMTC"
+HEADER = struct.Struct("<4sI")
+# Key check word, value, depth, flag, then the best action's piece index and position (255 for none)
+SLOT = struct.Struct("<QdBBBB")
+NO_ACTION = 255
+MASK_64 = (1 << 64) - 1
+
+
+def payload_check(payload):
+    """
+    Folds the 12 payload bytes of a slot into 64 bits
+    """
+    bits = int.from_bytes(payload, "little")
+    return (bits ^ (bits >> 64)) & MASK_64
+
+
+def create_cache_file(path, size):
+    """
+    Creates an empty cache file of `size` slots at path, unless a file is already there. The file
+    is written under a temporary name and linked into place, so no process ever maps a partly
+    written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, size))
+        f.truncate(HEADER.size + size * SLOT.size)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+
+
+class TTCache:
+    """
+    A cache file of `size` slots at path, created if it does not exist yet (an existing file keeps
+    its own size). Pickling a TTCache only keeps its path, and unpickling maps the file again, so
+    it can be handed to worker processes.
+    """
+
+    def __init__(self, path, size=1 << 20):
+        self.path = path
+        if not os.path.exists(path):
+            create_cache_file(path, size)
+        self.file = open(path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, self.size = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or len(self.mm) != HEADER.size + self.size * SLOT.size:
+            self.close()
+            raise ValueError(f"{path} is not a transposition cache file")
+
+    def probe(self, key):
+        """
+        Returns the (depth, flag, value, best_action) entry stored for key, or None
+        """
+        offset = HEADER.size + (key % self.size) * SLOT.size
+        slot = self.mm[offset:offset + SLOT.size]
+        check, value, depth, flag, rel_idx, pos = SLOT.unpack(slot)
+        if depth == 0 or check ^ payload_check(slot[8:]) != key:
+            return None
+        return depth, flag, value, None if rel_idx == NO_ACTION else (rel_idx, pos)
+
+    def store(self, key, depth, flag, value, best_action):
+        offset = HEADER.size + (key % self.size) * SLOT.size
+        if self.mm[offset + 16] > depth:
+            return
+        rel_idx, pos = (NO_ACTION, 0) if best_action is None else best_action
+        payload = SLOT.pack(0, value, min(depth, 255), flag, rel_idx, pos)[8:]
+        self.mm[offset:offset + SLOT.size] = (key ^ payload_check(payload)).to_bytes(8, "little") + payload
+
+    def __len__(self):
+        return sum(1 for i in range(self.size) if self.mm[HEADER.size + i * SLOT.size + 16])
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)